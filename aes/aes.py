@@ -1,3 +1,12 @@
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, wraps
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 
 s_box = (
@@ -97,7 +106,79 @@ def inv_mix_columns(s):
         s[i][2] ^= u
         s[i][3] ^= v
 
-    mix_columns(s)
+    # Not through `mix_columns`, so InvMixColumns is never counted as a
+    # MixColumns call.
+    for i in range(4):
+        mix_single_column(s[i])
+
+
+# The flat state used by the block engines: byte 4 * c + r holds row r of
+# column c, the same order as `bytes2matrix`. These functions work in place
+# on a bytearray and allocate nothing.
+shift_rows_map = tuple(((c + r) % 4) * 4 + r for c in range(4) for r in range(4))
+inv_shift_rows_map = tuple(((c - r) % 4) * 4 + r for c in range(4) for r in range(4))
+xtime_table = bytes(xtime(a) for a in range(256))
+
+
+def flat_sub_bytes(s):
+    for i in range(16):
+        s[i] = s_box[s[i]]
+
+
+def flat_inv_sub_bytes(s):
+    for i in range(16):
+        s[i] = inv_s_box[s[i]]
+
+
+# The private helpers below are shared by the forward and inverse steps.
+# They are never wrapped by `Profiler`, so an inverse step is not counted
+# as its forward counterpart.
+def _permute_state(s, scratch, index):
+    scratch[:] = s
+    for i in range(16):
+        s[i] = scratch[index[i]]
+
+
+def _mix_state(s):
+    for c in range(0, 16, 4):
+        a0 = s[c]
+        a1 = s[c + 1]
+        a2 = s[c + 2]
+        a3 = s[c + 3]
+        t = a0 ^ a1 ^ a2 ^ a3
+        s[c] = a0 ^ t ^ xtime_table[a0 ^ a1]
+        s[c + 1] = a1 ^ t ^ xtime_table[a1 ^ a2]
+        s[c + 2] = a2 ^ t ^ xtime_table[a2 ^ a3]
+        s[c + 3] = a3 ^ t ^ xtime_table[a3 ^ a0]
+
+
+def flat_shift_rows(s, scratch):
+    _permute_state(s, scratch, shift_rows_map)
+
+
+def flat_inv_shift_rows(s, scratch):
+    _permute_state(s, scratch, inv_shift_rows_map)
+
+
+def flat_add_round_key(s, k):
+    for i in range(16):
+        s[i] ^= k[i]
+
+
+def flat_mix_columns(s):
+    _mix_state(s)
+
+
+def flat_inv_mix_columns(s):
+    for c in range(0, 16, 4):
+        u = xtime_table[xtime_table[s[c] ^ s[c + 2]]]
+        v = xtime_table[xtime_table[s[c + 1] ^ s[c + 3]]]
+        s[c] ^= u
+        s[c + 1] ^= v
+        s[c + 2] ^= u
+        s[c + 3] ^= v
+
+    _mix_state(s)
 
 
 r_con = (
@@ -114,11 +195,48 @@ def bytes2matrix(text):
 
 def matrix2bytes(matrix):
     """ Converts a 4x4 matrix into a 16-byte array.  """
-    return bytes(sum(matrix, []))
+    return bytes(b for column in matrix for b in column)
 
 def xor_bytes(a, b):
     """ Returns a new byte array with the elements xor'ed. """
-    return bytes(i^j for i, j in zip(a, b))
+    n = min(len(a), len(b))
+    return (int.from_bytes(a[:n], 'big') ^ int.from_bytes(b[:n], 'big')).to_bytes(n, 'big')
+
+def xor_tail_into(src, dst, keystream):
+    """
+    XORs the bytes of `src` after its last full block with `keystream` into
+    the same positions of `dst`.
+    """
+    start = len(src) - len(src) % 16
+    for i in range(start, len(src)):
+        dst[i] = src[i] ^ keystream[i - start]
+
+def split_ranges(n_items, workers):
+    """
+    Splits `n_items` into at most `workers` consecutive `(first, count)`
+    ranges, keeping a single range when there is too little work to split.
+    """
+    if workers == 1 or n_items < 2 * workers:
+        return [(0, n_items)]
+    step = (n_items + workers - 1) // workers
+    return [(first, min(step, n_items - first)) for first in range(0, n_items, step)]
+
+def run_tasks(task, args_list, workers, executor=None):
+    """
+    Calls `task(*args)` for every entry of `args_list` and joins the byte
+    results in order. Runs in-process for a single task, otherwise in
+    `executor` or a new pool of `workers` processes.
+    """
+    if len(args_list) == 1:
+        return task(*args_list[0])
+
+    pool = executor or ProcessPoolExecutor(workers)
+    try:
+        futures = [pool.submit(task, *args) for args in args_list]
+        return b''.join(future.result() for future in futures)
+    finally:
+        if executor is None:
+            pool.shutdown()
 
 def inc_bytes(a):
     """ Returns a new byte array with the value increment by 1 """
@@ -157,6 +275,166 @@ def split_blocks(message, block_size=16, require_padding=True):
         return [message[i:i+16] for i in range(0, len(message), block_size)]
 
 
+def gf_mul(a, b):
+    """ Multiplies two bytes in GF(2^8) using the AES polynomial. """
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        a = xtime(a)
+        b >>= 1
+    return result
+
+def ror32(word, shift):
+    """ Rotates a 32-bit word right by `shift` bits. """
+    return ((word >> shift) | (word << (32 - shift))) & 0xFFFFFFFF
+
+# T-tables fusing SubBytes, ShiftRows and MixColumns into four lookups per
+# column (see Sec 4.2 in The Design of Rijndael). Te1..Te3 are rotations of Te0.
+Te0 = tuple((gf_mul(s, 2) << 24) | (s << 16) | (s << 8) | gf_mul(s, 3) for s in s_box)
+Te1 = tuple(ror32(t, 8) for t in Te0)
+Te2 = tuple(ror32(t, 16) for t in Te0)
+Te3 = tuple(ror32(t, 24) for t in Te0)
+
+# Same construction for InvSubBytes and InvMixColumns.
+Td0 = tuple((gf_mul(s, 14) << 24) | (gf_mul(s, 9) << 16) | (gf_mul(s, 13) << 8) | gf_mul(s, 11) for s in inv_s_box)
+Td1 = tuple(ror32(t, 8) for t in Td0)
+Td2 = tuple(ror32(t, 16) for t in Td0)
+Td3 = tuple(ror32(t, 24) for t in Td0)
+
+def inv_mix_column_word(word):
+    """ Applies InvMixColumns to a single column packed as a 32-bit word. """
+    return (Td0[s_box[word >> 24]] ^ Td1[s_box[(word >> 16) & 0xFF]] ^
+            Td2[s_box[(word >> 8) & 0xFF]] ^ Td3[s_box[word & 0xFF]])
+
+block_words = struct.Struct('>4I')
+
+# GHASH works on 128-bit integers read big-endian from the block, where the
+# most significant bit is the coefficient of x^0 (GCM's reflected order), so
+# multiplying by x is a right shift reduced by x^128 = 1 + x + x^2 + x^7.
+gcm_r = 0xE1 << 120
+
+def cmac_double(value):
+    """ Doubles a 128-bit integer in GF(2^128), as used for CMAC subkeys. """
+    value <<= 1
+    if value >> 128:
+        value ^= (1 << 128) | 0x87
+    return value
+
+def gf128_mul_x(v):
+    """ Multiplies a GHASH field element by x. """
+    return (v >> 1) ^ gcm_r if v & 1 else v >> 1
+
+def gcm_reduce_byte(b):
+    """ Returns the reduction of the low byte `b` after multiplying by x^8. """
+    for _ in range(8):
+        b = gf128_mul_x(b)
+    return b
+
+# Reductions for the Shoup 8-bit table method, independent of the key.
+gcm_reduce8 = tuple(gcm_reduce_byte(b) for b in range(256))
+
+if np is not None:
+    # Lookup tables and index maps for the batched engine, which works on
+    # (N, 16) uint8 arrays laid out like `bytes2matrix` (column-major).
+    batch_s_box = np.array(s_box, dtype=np.uint8)
+    batch_inv_s_box = np.array(inv_s_box, dtype=np.uint8)
+    batch_xtime = np.array([xtime(a) for a in range(256)], dtype=np.uint8)
+    batch_xtime2 = np.array([xtime(xtime(a)) for a in range(256)], dtype=np.uint8)
+    shift_rows_index = np.array(shift_rows_map)
+    inv_shift_rows_index = np.array(inv_shift_rows_map)
+
+def require_numpy():
+    if np is None:
+        raise ImportError('The batched AES engine requires NumPy.')
+
+def batch_mix_columns(s):
+    """ MixColumns over a (N, 4, 4) array of columns, see `mix_single_column`. """
+    t = s[:, :, 0] ^ s[:, :, 1] ^ s[:, :, 2] ^ s[:, :, 3]
+    return s ^ t[:, :, None] ^ batch_xtime[s ^ np.roll(s, -1, axis=2)]
+
+def batch_inv_mix_columns(s):
+    """ InvMixColumns over a (N, 4, 4) array of columns, see `inv_mix_columns`. """
+    return batch_mix_columns(s ^ batch_xtime2[s ^ np.roll(s, -2, axis=2)])
+
+def batch_cipher(state, round_keys, inverse=False):
+    """
+    Runs the (equivalent inverse) cipher over an (N, 16) uint8 state.
+    `round_keys[i]` is either a (16,) round key shared by all blocks or an
+    (N, 16) array holding one round key per block.
+    """
+    box, index, mix = ((batch_inv_s_box, inv_shift_rows_index, batch_inv_mix_columns) if inverse
+                       else (batch_s_box, shift_rows_index, batch_mix_columns))
+    n = len(state)
+    state = state ^ round_keys[0]
+    for i in range(1, len(round_keys) - 1):
+        state = box[state][:, index]
+        state = mix(state.reshape(n, 4, 4)).reshape(n, 16)
+        state ^= round_keys[i]
+
+    state = box[state][:, index]
+    state ^= round_keys[-1]
+    return np.ascontiguousarray(state)
+
+def batch_expand_keys(keys):
+    """
+    Expands an (N, 16), (N, 24) or (N, 32) uint8 array of keys at once,
+    returning the (N, n_rounds + 1, 16) array of round keys. Each step of
+    the key schedule runs across all N keys.
+    """
+    require_numpy()
+    keys = np.asarray(keys, dtype=np.uint8)
+    assert keys.ndim == 2 and keys.shape[1] in AES.rounds_by_key_size
+    n_rounds = AES.rounds_by_key_size[keys.shape[1]]
+    iteration_size = keys.shape[1] // 4
+    words = np.empty((len(keys), (n_rounds + 1) * 4, 4), dtype=np.uint8)
+    words[:, :iteration_size] = keys.reshape(len(keys), iteration_size, 4)
+
+    for i in range(iteration_size, (n_rounds + 1) * 4):
+        word = words[:, i - 1]
+        if i % iteration_size == 0:
+            word = batch_s_box[np.roll(word, -1, axis=1)]
+            word[:, 0] ^= r_con[i // iteration_size]
+        elif iteration_size == 8 and i % iteration_size == 4:
+            word = batch_s_box[word]
+        words[:, i] = words[:, i - iteration_size] ^ word
+
+    return words.reshape(len(keys), n_rounds + 1, 16)
+
+def batch_encrypt_blocks(keys, blocks):
+    """
+    Encrypts block `i` of an (N, 16) uint8 array under key `i`, for all N
+    in lock-step. `keys` are raw keys, or a schedule from
+    `batch_expand_keys` to reuse it across calls.
+    """
+    require_numpy()
+    schedule = np.asarray(keys, dtype=np.uint8)
+    if schedule.ndim == 2:
+        schedule = batch_expand_keys(schedule)
+    state = np.asarray(blocks, dtype=np.uint8)
+    assert state.ndim == 2 and state.shape[1] == 16 and len(state) == len(schedule)
+    return batch_cipher(state, schedule.swapaxes(0, 1))
+
+def batch_decrypt_blocks(keys, blocks):
+    """
+    Decrypts block `i` of an (N, 16) uint8 array under key `i`, see
+    `batch_encrypt_blocks`.
+    """
+    require_numpy()
+    schedule = np.asarray(keys, dtype=np.uint8)
+    if schedule.ndim == 2:
+        schedule = batch_expand_keys(schedule)
+    state = np.asarray(blocks, dtype=np.uint8)
+    assert state.ndim == 2 and state.shape[1] == 16 and len(state) == len(schedule)
+
+    # Equivalent inverse cipher schedule: reversed, with InvMixColumns
+    # applied to the inner round keys.
+    round_keys = schedule.swapaxes(0, 1)[::-1].copy()
+    inner = round_keys[1:-1]
+    round_keys[1:-1] = batch_inv_mix_columns(inner.reshape(-1, 4, 4)).reshape(inner.shape)
+    return batch_cipher(state, round_keys, inverse=True)
+
+
 class AES:
     """
     Class for AES-128 encryption with CBC mode and PKCS#7.
@@ -165,13 +443,67 @@ class AES:
     management. Unless you need that, please use `encrypt` and `decrypt`.
     """
     rounds_by_key_size = {16: 10, 24: 12, 32: 14}
-    def __init__(self, master_key):
+    engines = ('table', 'reference')
+    def __init__(self, master_key, engine='table'):
         """
         Initializes the object with a given key.
+
+        `engine` selects the block implementation: 'table' runs on 32-bit
+        column words with the Te/Td lookup tables, 'reference' runs the
+        textbook round functions over a flat 16-byte state kept in the
+        object, so a 'reference' object must not be shared between threads.
         """
         assert len(master_key) in AES.rounds_by_key_size
+        assert engine in AES.engines
         self.n_rounds = AES.rounds_by_key_size[len(master_key)]
+        self.engine = engine
         self._key_matrices = self._expand_key(master_key)
+        self._enc_words = [int.from_bytes(bytes(word), 'big') for matrix in self._key_matrices for word in matrix]
+        self._dec_words = self._expand_decryption_key(self._enc_words)
+        self._dec_key_matrices = [
+            [list(word.to_bytes(4, 'big')) for word in self._dec_words[4 * i : 4 * (i + 1)]]
+            for i in range(self.n_rounds + 1)
+        ]
+        self._init_state()
+
+    def _init_state(self):
+        """
+        Allocates the reusable state buffers and flat round keys of the
+        reference engine. The 'table' engine uses neither.
+        """
+        if self.engine != 'reference':
+            return
+        self._state = bytearray(16)
+        self._scratch = bytearray(16)
+        self._enc_round_keys = [matrix2bytes(matrix) for matrix in self._key_matrices]
+        self._dec_round_keys = [matrix2bytes(matrix) for matrix in self._dec_key_matrices]
+
+    @classmethod
+    def cached(cls, master_key, engine='table'):
+        """
+        Returns an AES object for `master_key`, taking the expanded key
+        schedules from the process-wide `schedule_cache` when possible.
+        Objects for the same key share one read-only `SharedSchedule`.
+        """
+        assert len(master_key) in AES.rounds_by_key_size
+        assert engine in AES.engines
+        cache = schedule_cache
+        digest = sha256(bytes(master_key)).digest()
+        schedule = cache.get(digest)
+        if schedule is None:
+            aes = cls(master_key, engine)
+            aes._schedule = SharedSchedule(aes._key_matrices, aes._enc_words,
+                                           aes._dec_words, aes._dec_key_matrices)
+            cache.put(digest, aes._schedule)
+            return aes
+
+        aes = cls.__new__(cls)
+        aes.n_rounds = AES.rounds_by_key_size[len(master_key)]
+        aes.engine = engine
+        aes._schedule = schedule
+        aes._key_matrices, aes._enc_words, aes._dec_words, aes._dec_key_matrices = schedule.rounds
+        aes._init_state()
+        return aes
 
     def _expand_key(self, master_key):
         """
@@ -207,27 +539,76 @@ class AES:
         # Group key words in 4x4 byte matrices.
         return [key_columns[4*i : 4*(i+1)] for i in range(len(key_columns) // 4)]
 
+    def _expand_decryption_key(self, words):
+        """
+        Returns the flat round-key schedule for the equivalent inverse cipher
+        (Sec 5.3.5 in FIPS-197): the encryption round keys in reverse order,
+        with InvMixColumns applied to every round key except the first and
+        last. Decryption then runs the same round structure as encryption.
+        """
+        n = self.n_rounds
+        dec_words = []
+        for i in range(n + 1):
+            round_words = words[4 * (n - i) : 4 * (n - i + 1)]
+            if 0 < i < n:
+                round_words = [inv_mix_column_word(w) for w in round_words]
+            dec_words.extend(round_words)
+        return dec_words
+
     def encrypt_block(self, plaintext):
         """
         Encrypts a single block of 16 byte long plaintext.
         """
         assert len(plaintext) == 16
 
-        plain_state = bytes2matrix(plaintext)
+        if self.engine == 'reference':
+            return self._encrypt_block_reference(plaintext)
 
-        add_round_key(plain_state, self._key_matrices[0])
+        return block_words.pack(*self._encrypt_words(*block_words.unpack(plaintext)))
 
-        for i in range(1, self.n_rounds):
-            sub_bytes(plain_state)
-            shift_rows(plain_state)
-            mix_columns(plain_state)
-            add_round_key(plain_state, self._key_matrices[i])
+    def encrypt_block_into(self, plaintext, out):
+        """
+        Encrypts a 16-byte block into the first 16 bytes of the writable
+        buffer `out`. With the 'reference' engine this allocates nothing.
+        """
+        assert len(plaintext) == 16
 
-        sub_bytes(plain_state)
-        shift_rows(plain_state)
-        add_round_key(plain_state, self._key_matrices[-1])
+        if self.engine == 'reference':
+            state = self._state
+            state[:] = plaintext
+            self._encrypt_state()
+            out[:16] = state
+        else:
+            block_words.pack_into(out, 0, *self._encrypt_words(*block_words.unpack(plaintext)))
 
-        return matrix2bytes(plain_state)
+    def _encrypt_words(self, s0, s1, s2, s3):
+        """
+        Encrypts a block given and returned as four big-endian column words.
+        """
+        if self.engine == 'reference':
+            return block_words.unpack(self._encrypt_block_reference(block_words.pack(s0, s1, s2, s3)))
+
+        rk = self._enc_words
+        s0 ^= rk[0]
+        s1 ^= rk[1]
+        s2 ^= rk[2]
+        s3 ^= rk[3]
+
+        for i in range(4, 4 * self.n_rounds, 4):
+            t0 = Te0[s0 >> 24] ^ Te1[(s1 >> 16) & 0xFF] ^ Te2[(s2 >> 8) & 0xFF] ^ Te3[s3 & 0xFF] ^ rk[i]
+            t1 = Te0[s1 >> 24] ^ Te1[(s2 >> 16) & 0xFF] ^ Te2[(s3 >> 8) & 0xFF] ^ Te3[s0 & 0xFF] ^ rk[i + 1]
+            t2 = Te0[s2 >> 24] ^ Te1[(s3 >> 16) & 0xFF] ^ Te2[(s0 >> 8) & 0xFF] ^ Te3[s1 & 0xFF] ^ rk[i + 2]
+            t3 = Te0[s3 >> 24] ^ Te1[(s0 >> 16) & 0xFF] ^ Te2[(s1 >> 8) & 0xFF] ^ Te3[s2 & 0xFF] ^ rk[i + 3]
+            s0, s1, s2, s3 = t0, t1, t2, t3
+
+        # Final round has no MixColumns, so only the S-box is applied.
+        i = 4 * self.n_rounds
+        return (
+            ((s_box[s0 >> 24] << 24) | (s_box[(s1 >> 16) & 0xFF] << 16) | (s_box[(s2 >> 8) & 0xFF] << 8) | s_box[s3 & 0xFF]) ^ rk[i],
+            ((s_box[s1 >> 24] << 24) | (s_box[(s2 >> 16) & 0xFF] << 16) | (s_box[(s3 >> 8) & 0xFF] << 8) | s_box[s0 & 0xFF]) ^ rk[i + 1],
+            ((s_box[s2 >> 24] << 24) | (s_box[(s3 >> 16) & 0xFF] << 16) | (s_box[(s0 >> 8) & 0xFF] << 8) | s_box[s1 & 0xFF]) ^ rk[i + 2],
+            ((s_box[s3 >> 24] << 24) | (s_box[(s0 >> 16) & 0xFF] << 16) | (s_box[(s1 >> 8) & 0xFF] << 8) | s_box[s2 & 0xFF]) ^ rk[i + 3],
+        )
 
     def decrypt_block(self, ciphertext):
         """
@@ -235,21 +616,152 @@ class AES:
         """
         assert len(ciphertext) == 16
 
-        cipher_state = bytes2matrix(ciphertext)
+        if self.engine == 'reference':
+            return self._decrypt_block_reference(ciphertext)
 
-        add_round_key(cipher_state, self._key_matrices[-1])
-        inv_shift_rows(cipher_state)
-        inv_sub_bytes(cipher_state)
+        return block_words.pack(*self._decrypt_words(*block_words.unpack(ciphertext)))
+
+    def decrypt_block_into(self, ciphertext, out):
+        """
+        Decrypts a 16-byte block into the first 16 bytes of the writable
+        buffer `out`, see `encrypt_block_into`.
+        """
+        assert len(ciphertext) == 16
 
-        for i in range(self.n_rounds - 1, 0, -1):
-            add_round_key(cipher_state, self._key_matrices[i])
-            inv_mix_columns(cipher_state)
-            inv_shift_rows(cipher_state)
-            inv_sub_bytes(cipher_state)
+        if self.engine == 'reference':
+            state = self._state
+            state[:] = ciphertext
+            self._decrypt_state()
+            out[:16] = state
+        else:
+            block_words.pack_into(out, 0, *self._decrypt_words(*block_words.unpack(ciphertext)))
 
-        add_round_key(cipher_state, self._key_matrices[0])
+    def _decrypt_words(self, s0, s1, s2, s3):
+        """
+        Decrypts a block given and returned as four big-endian column words.
+        """
+        if self.engine == 'reference':
+            return block_words.unpack(self._decrypt_block_reference(block_words.pack(s0, s1, s2, s3)))
+
+        rk = self._dec_words
+        s0 ^= rk[0]
+        s1 ^= rk[1]
+        s2 ^= rk[2]
+        s3 ^= rk[3]
+
+        for i in range(4, 4 * self.n_rounds, 4):
+            t0 = Td0[s0 >> 24] ^ Td1[(s3 >> 16) & 0xFF] ^ Td2[(s2 >> 8) & 0xFF] ^ Td3[s1 & 0xFF] ^ rk[i]
+            t1 = Td0[s1 >> 24] ^ Td1[(s0 >> 16) & 0xFF] ^ Td2[(s3 >> 8) & 0xFF] ^ Td3[s2 & 0xFF] ^ rk[i + 1]
+            t2 = Td0[s2 >> 24] ^ Td1[(s1 >> 16) & 0xFF] ^ Td2[(s0 >> 8) & 0xFF] ^ Td3[s3 & 0xFF] ^ rk[i + 2]
+            t3 = Td0[s3 >> 24] ^ Td1[(s2 >> 16) & 0xFF] ^ Td2[(s1 >> 8) & 0xFF] ^ Td3[s0 & 0xFF] ^ rk[i + 3]
+            s0, s1, s2, s3 = t0, t1, t2, t3
+
+        i = 4 * self.n_rounds
+        return (
+            ((inv_s_box[s0 >> 24] << 24) | (inv_s_box[(s3 >> 16) & 0xFF] << 16) | (inv_s_box[(s2 >> 8) & 0xFF] << 8) | inv_s_box[s1 & 0xFF]) ^ rk[i],
+            ((inv_s_box[s1 >> 24] << 24) | (inv_s_box[(s0 >> 16) & 0xFF] << 16) | (inv_s_box[(s3 >> 8) & 0xFF] << 8) | inv_s_box[s2 & 0xFF]) ^ rk[i + 1],
+            ((inv_s_box[s2 >> 24] << 24) | (inv_s_box[(s1 >> 16) & 0xFF] << 16) | (inv_s_box[(s0 >> 8) & 0xFF] << 8) | inv_s_box[s3 & 0xFF]) ^ rk[i + 2],
+            ((inv_s_box[s3 >> 24] << 24) | (inv_s_box[(s2 >> 16) & 0xFF] << 16) | (inv_s_box[(s1 >> 8) & 0xFF] << 8) | inv_s_box[s0 & 0xFF]) ^ rk[i + 3],
+        )
+
+    def _batch_round_keys(self):
+        """
+        Returns the round keys as a cached (n_rounds + 1, 16) uint8 array.
+        """
+        if getattr(self, '_round_keys_array', None) is None:
+            self._round_keys_array = np.array(
+                [[b for word in matrix for b in word] for matrix in self._key_matrices],
+                dtype=np.uint8,
+            )
+        return self._round_keys_array
+
+    def _batch_dec_round_keys(self):
+        """
+        Returns the equivalent inverse cipher round keys as a cached
+        (n_rounds + 1, 16) uint8 array.
+        """
+        if getattr(self, '_dec_round_keys_array', None) is None:
+            self._dec_round_keys_array = np.array(
+                [[b for word in matrix for b in word] for matrix in self._dec_key_matrices],
+                dtype=np.uint8,
+            )
+        return self._dec_round_keys_array
+
+    def encrypt_blocks(self, blocks):
+        """
+        Encrypts an (N, 16) uint8 array of blocks at once, returning a new
+        array. Every round step is a table gather or XOR across all N blocks.
+        """
+        require_numpy()
+        state = np.asarray(blocks, dtype=np.uint8)
+        assert state.ndim == 2 and state.shape[1] == 16
+        return batch_cipher(state, self._batch_round_keys())
+
+    def decrypt_blocks(self, blocks):
+        """
+        Decrypts an (N, 16) uint8 array of blocks at once, returning a new
+        array.
+        """
+        require_numpy()
+        state = np.asarray(blocks, dtype=np.uint8)
+        assert state.ndim == 2 and state.shape[1] == 16
+        # Equivalent inverse cipher: same round structure as encrypt_blocks.
+        return batch_cipher(state, self._batch_dec_round_keys(), inverse=True)
+
+    def _encrypt_block_reference(self, plaintext):
+        """
+        Encrypts a single block with the textbook round functions.
+        """
+        state = self._state
+        state[:] = plaintext
+        self._encrypt_state()
+        return bytes(state)
+
+    def _decrypt_block_reference(self, ciphertext):
+        """
+        Decrypts a single block with the textbook inverse round functions.
+        """
+        state = self._state
+        state[:] = ciphertext
+        self._decrypt_state()
+        return bytes(state)
+
+    def _encrypt_state(self):
+        """
+        Encrypts the flat state buffer in place.
+        """
+        state, scratch, round_keys = self._state, self._scratch, self._enc_round_keys
+
+        flat_add_round_key(state, round_keys[0])
+
+        for i in range(1, self.n_rounds):
+            flat_sub_bytes(state)
+            flat_shift_rows(state, scratch)
+            flat_mix_columns(state)
+            flat_add_round_key(state, round_keys[i])
+
+        flat_sub_bytes(state)
+        flat_shift_rows(state, scratch)
+        flat_add_round_key(state, round_keys[-1])
+
+    def _decrypt_state(self):
+        """
+        Decrypts the flat state buffer in place, arranged as the equivalent
+        inverse cipher.
+        """
+        state, scratch, round_keys = self._state, self._scratch, self._dec_round_keys
 
-        return matrix2bytes(cipher_state)
+        flat_add_round_key(state, round_keys[0])
+
+        for i in range(1, self.n_rounds):
+            flat_inv_sub_bytes(state)
+            flat_inv_shift_rows(state, scratch)
+            flat_inv_mix_columns(state)
+            flat_add_round_key(state, round_keys[i])
+
+        flat_inv_sub_bytes(state)
+        flat_inv_shift_rows(state, scratch)
+        flat_add_round_key(state, round_keys[-1])
 
     def encrypt_cbc(self, plaintext, iv):
         """
@@ -424,9 +936,462 @@ class AES:
 
         return b''.join(blocks)
 
+    def encrypt_cbc_into(self, src, dst, iv):
+        """
+        Encrypts `src` using CBC mode and PKCS#7 padding, writing the
+        ciphertext directly into the writable buffer `dst`, which may be `src`
+        itself when it has room for the padding. Returns the number of bytes
+        written.
+        """
+        assert len(iv) == 16
+
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        n = len(src)
+        full = n - n % 16
+        assert len(dst) >= full + 16
+
+        c0, c1, c2, c3 = block_words.unpack(iv)
+        for offset in range(0, full + 16, 16):
+            if offset < full:
+                p0, p1, p2, p3 = block_words.unpack_from(src, offset)
+            else:
+                p0, p1, p2, p3 = block_words.unpack(pad(src[full:].tobytes()))
+            # CBC mode encrypt: encrypt(plaintext_block XOR previous)
+            c0, c1, c2, c3 = self._encrypt_words(p0 ^ c0, p1 ^ c1, p2 ^ c2, p3 ^ c3)
+            block_words.pack_into(dst, offset, c0, c1, c2, c3)
+
+        return full + 16
+
+    def decrypt_cbc_into(self, src, dst, iv):
+        """
+        Decrypts `src` using CBC mode and PKCS#7 padding, writing the plaintext
+        directly into the writable buffer `dst` (which may be `src`). Returns
+        the length of the unpadded plaintext; the padding bytes are left in
+        `dst` after it.
+        """
+        assert len(iv) == 16
+
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        n = len(src)
+        assert n % 16 == 0 and n > 0 and len(dst) >= n
+
+        c0, c1, c2, c3 = block_words.unpack(iv)
+        for offset in range(0, n, 16):
+            previous = c0, c1, c2, c3
+            c0, c1, c2, c3 = block_words.unpack_from(src, offset)
+            # CBC mode decrypt: previous XOR decrypt(ciphertext)
+            d0, d1, d2, d3 = self._decrypt_words(c0, c1, c2, c3)
+            block_words.pack_into(dst, offset, d0 ^ previous[0], d1 ^ previous[1], d2 ^ previous[2], d3 ^ previous[3])
+
+        padding_len = dst[n - 1]
+        assert 0 < padding_len <= 16
+        assert all(p == padding_len for p in dst[n - padding_len:n])
+        return n - padding_len
+
+    def encrypt_cfb_into(self, src, dst, iv):
+        """
+        Encrypts `src` with the given initialization vector (iv) in CFB mode,
+        writing the ciphertext directly into the writable buffer `dst` (which
+        may be `src`). Returns the number of bytes written.
+        """
+        assert len(iv) == 16
+
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        n = len(src)
+        assert len(dst) >= n
+
+        c0, c1, c2, c3 = block_words.unpack(iv)
+        for offset in range(0, n - n % 16, 16):
+            # CFB mode encrypt: plaintext_block XOR encrypt(prev_ciphertext)
+            k0, k1, k2, k3 = self._encrypt_words(c0, c1, c2, c3)
+            p0, p1, p2, p3 = block_words.unpack_from(src, offset)
+            c0, c1, c2, c3 = p0 ^ k0, p1 ^ k1, p2 ^ k2, p3 ^ k3
+            block_words.pack_into(dst, offset, c0, c1, c2, c3)
+
+        if n % 16:
+            xor_tail_into(src, dst, block_words.pack(*self._encrypt_words(c0, c1, c2, c3)))
+        return n
+
+    def decrypt_cfb_into(self, src, dst, iv):
+        """
+        Decrypts `src` with the given initialization vector (iv) in CFB mode,
+        writing the plaintext directly into the writable buffer `dst` (which
+        may be `src`). Returns the number of bytes written.
+        """
+        assert len(iv) == 16
+
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        n = len(src)
+        assert len(dst) >= n
+
+        c0, c1, c2, c3 = block_words.unpack(iv)
+        for offset in range(0, n - n % 16, 16):
+            # CFB mode decrypt: ciphertext XOR encrypt(prev_ciphertext)
+            k0, k1, k2, k3 = self._encrypt_words(c0, c1, c2, c3)
+            c0, c1, c2, c3 = block_words.unpack_from(src, offset)
+            block_words.pack_into(dst, offset, c0 ^ k0, c1 ^ k1, c2 ^ k2, c3 ^ k3)
+
+        if n % 16:
+            xor_tail_into(src, dst, block_words.pack(*self._encrypt_words(c0, c1, c2, c3)))
+        return n
+
+    def encrypt_ofb_into(self, src, dst, iv):
+        """
+        Encrypts `src` using OFB mode with the given initialization vector
+        (iv), writing the ciphertext directly into the writable buffer `dst`
+        (which may be `src`). Returns the number of bytes written.
+        """
+        assert len(iv) == 16
+
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        n = len(src)
+        assert len(dst) >= n
+
+        k0, k1, k2, k3 = block_words.unpack(iv)
+        for offset in range(0, n - n % 16, 16):
+            # OFB mode encrypt: plaintext_block XOR encrypt(previous)
+            k0, k1, k2, k3 = self._encrypt_words(k0, k1, k2, k3)
+            p0, p1, p2, p3 = block_words.unpack_from(src, offset)
+            block_words.pack_into(dst, offset, p0 ^ k0, p1 ^ k1, p2 ^ k2, p3 ^ k3)
+
+        if n % 16:
+            xor_tail_into(src, dst, block_words.pack(*self._encrypt_words(k0, k1, k2, k3)))
+        return n
+
+    def decrypt_ofb_into(self, src, dst, iv):
+        """
+        Decrypts `src` using OFB mode with the given initialization vector
+        (iv), writing the plaintext directly into `dst`.
+        """
+        return self.encrypt_ofb_into(src, dst, iv)
+
+    def encrypt_ctr_into(self, src, dst, iv):
+        """
+        Encrypts `src` using CTR mode with the given nounce/IV, writing the
+        ciphertext directly into the writable buffer `dst` (which may be
+        `src`). Returns the number of bytes written.
+        """
+        assert len(iv) == 16
+
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        n = len(src)
+        assert len(dst) >= n
+
+        counter = int.from_bytes(iv, 'big')
+        for offset in range(0, n - n % 16, 16):
+            # CTR mode encrypt: plaintext_block XOR encrypt(nonce)
+            k0, k1, k2, k3 = self._encrypt_words(counter >> 96, (counter >> 64) & 0xFFFFFFFF, (counter >> 32) & 0xFFFFFFFF, counter & 0xFFFFFFFF)
+            p0, p1, p2, p3 = block_words.unpack_from(src, offset)
+            block_words.pack_into(dst, offset, p0 ^ k0, p1 ^ k1, p2 ^ k2, p3 ^ k3)
+            counter = (counter + 1) % 2**128
+
+        if n % 16:
+            xor_tail_into(src, dst, self.encrypt_block(counter.to_bytes(16, 'big')))
+        return n
+
+    def decrypt_ctr_into(self, src, dst, iv):
+        """
+        Decrypts `src` using CTR mode with the given nounce/IV, writing the
+        plaintext directly into `dst`.
+        """
+        return self.encrypt_ctr_into(src, dst, iv)
+
+    def _ctr_keystream(self, iv, first_block, n_blocks):
+        """
+        Returns the CTR keystream for the `n_blocks` counter blocks starting
+        `first_block` blocks after `iv`, exactly as `inc_bytes` would walk it.
+        """
+        start = int.from_bytes(iv, 'big') + first_block
+        if np is None:
+            return b''.join(self.encrypt_block(((start + i) % 2**128).to_bytes(16, 'big')) for i in range(n_blocks))
+
+        # Build the counters as two big-endian 64-bit halves, carrying
+        # overflow of the low half into the high half.
+        high, low = (start >> 64) % 2**64, start % 2**64
+        lows = np.arange(n_blocks, dtype=np.uint64) + np.uint64(low)
+        highs = np.full(n_blocks, high, dtype=np.uint64) + (lows < np.uint64(low))
+        counters = np.stack([highs, lows], axis=1).astype('>u8').view(np.uint8)
+        return self.encrypt_blocks(counters).tobytes()
+
+    def decrypt_ctr_range(self, ciphertext, iv, offset, length):
+        """
+        Decrypts `length` bytes starting at byte `offset` of a CTR ciphertext
+        encrypted with the given nounce/IV, without touching the rest of it.
+
+        `ciphertext` is either a bytes-like object or a seekable binary file.
+        The range is clipped to the end of the ciphertext.
+        """
+        assert len(iv) == 16
+        assert offset >= 0 and length >= 0
+
+        if hasattr(ciphertext, 'read'):
+            ciphertext.seek(offset)
+            data = ciphertext.read(length)
+        else:
+            data = ciphertext[offset:offset + length]
+
+        # The counter for byte `offset` is iv + offset // 16; a partial first
+        # block skips the start of its keystream block.
+        first_block, skip = divmod(offset, 16)
+        n_blocks = (skip + len(data) + 15) // 16
+        keystream = self._ctr_keystream(iv, first_block, n_blocks)
+        return xor_bytes(data, keystream[skip:])
+
+    def _ecb_encrypt(self, data):
+        """
+        Encrypts a whole number of 16-byte blocks independently.
+        """
+        if np is None:
+            return b''.join(self.encrypt_block(block) for block in split_blocks(data))
+        return self.encrypt_blocks(np.frombuffer(data, dtype=np.uint8).reshape(-1, 16)).tobytes()
+
+    def _ecb_decrypt(self, data):
+        """
+        Decrypts a whole number of 16-byte blocks independently.
+        """
+        if np is None:
+            return b''.join(self.decrypt_block(block) for block in split_blocks(data))
+        return self.decrypt_blocks(np.frombuffer(data, dtype=np.uint8).reshape(-1, 16)).tobytes()
+
+    def _map_block_ranges(self, task, n_blocks, workers, executor, data=None):
+        """
+        Calls `task(first_block, n_blocks)` over consecutive block ranges, one
+        per worker, in a process pool and joins the results in order. When
+        `data` is given, the task receives the bytes of its range instead.
+
+        Runs in-process when there is a single worker or too little work to
+        split.
+        """
+        workers = workers or os.cpu_count() or 1
+        ranges = split_ranges(n_blocks, workers)
+        if data is not None:
+            ranges = [(data[16 * first : 16 * (first + count)],) for first, count in ranges]
+        return run_tasks(task, ranges, workers, executor)
+
+    def encrypt_ctr_parallel(self, plaintext, iv, workers=None, executor=None):
+        """
+        Encrypts `plaintext` using CTR mode with the given nounce/IV, splitting
+        the counter range across a pool of processes. The output is identical
+        to `encrypt_ctr`.
+
+        `workers` defaults to the number of CPUs. An existing
+        `concurrent.futures` executor may be passed to avoid pool start-up.
+        """
+        assert len(iv) == 16
+
+        n_blocks = (len(plaintext) + 15) // 16
+        keystream = self._map_block_ranges(partial(self._ctr_keystream, iv), n_blocks, workers, executor)
+        return xor_bytes(plaintext, keystream)
+
+    def decrypt_ctr_parallel(self, ciphertext, iv, workers=None, executor=None):
+        """
+        Decrypts `ciphertext` using CTR mode with the given nounce/IV, splitting
+        the counter range across a pool of processes.
+        """
+        return self.encrypt_ctr_parallel(ciphertext, iv, workers, executor)
+
+    def decrypt_cbc_parallel(self, ciphertext, iv, workers=1, executor=None):
+        """
+        Decrypts `ciphertext` using CBC mode and PKCS#7 padding, with the given
+        initialization vector (iv). The output is identical to `decrypt_cbc`.
+
+        All blocks are decrypted in one batch, then XOR'ed with the previous
+        ciphertext blocks in a single pass. With `workers` > 1 the batch is
+        split across a pool of processes.
+        """
+        assert len(iv) == 16
+        assert len(ciphertext) % 16 == 0
+
+        decrypted = self._map_block_ranges(self._ecb_decrypt, len(ciphertext) // 16, workers, executor, ciphertext)
+        # CBC mode decrypt: previous XOR decrypt(ciphertext)
+        return unpad(xor_bytes(decrypted, iv + ciphertext[:-16]))
+
+    def decrypt_cfb_parallel(self, ciphertext, iv, workers=1, executor=None):
+        """
+        Decrypts `ciphertext` with the given initialization vector (iv). The
+        output is identical to `decrypt_cfb`.
+
+        The keystream is the encryption of the IV and every ciphertext block
+        but the last, so it is computed in one batch (or across a pool of
+        processes with `workers` > 1) and XOR'ed in a single pass.
+        """
+        assert len(iv) == 16
+
+        n_blocks = (len(ciphertext) + 15) // 16
+        previous = iv + ciphertext[:16 * (n_blocks - 1)]
+        keystream = self._map_block_ranges(self._ecb_encrypt, n_blocks, workers, executor, previous)
+        # CFB mode decrypt: ciphertext XOR encrypt(prev_ciphertext)
+        return xor_bytes(ciphertext, keystream)
+
+
+    def _ghash_table(self):
+        """
+        Returns the per-key Shoup 8-bit table: entry `b` is the product of H
+        with the byte `b` placed in the top byte of a block. Built on first use
+        and cached on the instance.
+        """
+        if getattr(self, '_ghash_table_cache', None) is None:
+            table = [0] * 256
+            h = int.from_bytes(self.encrypt_block(bytes(16)), 'big')
+            # Single bits are H times x^0..x^7, the rest follows by linearity.
+            bit = 0x80
+            while bit:
+                table[bit] = h
+                h = gf128_mul_x(h)
+                bit >>= 1
+            for b in range(256):
+                if b & (b - 1):
+                    table[b] = table[b & -b] ^ table[b & (b - 1)]
+            self._ghash_table_cache = table
+        return self._ghash_table_cache
+
+    def _ghash(self, y, data):
+        """
+        Absorbs `data`, zero-padded to whole blocks, into the GHASH state `y`.
+        """
+        table = self._ghash_table()
+        for offset in range(0, len(data), 16):
+            x = y ^ int.from_bytes(bytes(data[offset:offset + 16]).ljust(16, b'\x00'), 'big')
+            # Horner's rule a byte at a time, starting from the highest powers.
+            y = 0
+            for shift in range(0, 128, 8):
+                y = (y >> 8) ^ gcm_reduce8[y & 0xFF] ^ table[(x >> shift) & 0xFF]
+        return y
+
+    def _gcm_keystream(self, counter, first_block, n_blocks):
+        """
+        Returns the GCTR keystream, which only increments the low 32 bits of
+        the 16-byte `counter` block.
+        """
+        prefix, low = counter[:12], int.from_bytes(counter[12:], 'big') + first_block
+        if np is None:
+            return b''.join(self.encrypt_block(prefix + ((low + i) % 2**32).to_bytes(4, 'big')) for i in range(n_blocks))
+
+        counters = np.empty((n_blocks, 16), dtype=np.uint8)
+        counters[:, :12] = np.frombuffer(prefix, dtype=np.uint8)
+        lows = (np.arange(n_blocks, dtype=np.uint64) + np.uint64(low)) % np.uint64(2**32)
+        counters[:, 12:] = lows.astype('>u4').view(np.uint8).reshape(n_blocks, 4)
+        return self.encrypt_blocks(counters).tobytes()
 
+    def _gcm_pre_counter(self, iv):
+        """
+        Returns the pre-counter block J0 for the given IV.
+        """
+        assert len(iv) > 0
+        if len(iv) == 12:
+            return iv + b'\x00\x00\x00\x01'
+        y = self._ghash(0, iv)
+        y = self._ghash(y, (len(iv) * 8).to_bytes(16, 'big'))
+        return y.to_bytes(16, 'big')
+
+    def _gcm(self, data, iv, associated_data, encrypting, chunk_size=64 * 1024):
+        """
+        Runs GCTR over `data` and GHASH over the ciphertext in a single pass,
+        chunk by chunk. Returns the output and the full 16-byte tag.
+        """
+        j0 = self._gcm_pre_counter(iv)
+        y = self._ghash(0, associated_data)
+        output = []
+        for offset in range(0, len(data), chunk_size):
+            chunk = data[offset:offset + chunk_size]
+            # The first counter block after J0 encrypts the data.
+            keystream = self._gcm_keystream(j0, 1 + offset // 16, (len(chunk) + 15) // 16)
+            result = xor_bytes(chunk, keystream)
+            y = self._ghash(y, result if encrypting else chunk)
+            output.append(result)
+
+        lengths = (len(associated_data) * 8).to_bytes(8, 'big') + (len(data) * 8).to_bytes(8, 'big')
+        y = self._ghash(y, lengths)
+        tag = xor_bytes(self.encrypt_block(j0), y.to_bytes(16, 'big'))
+        return b''.join(output), tag
+
+    def encrypt_gcm(self, plaintext, iv, associated_data=b''):
+        """
+        Encrypts and authenticates `plaintext` using GCM mode with the given
+        IV (12 bytes recommended), also authenticating `associated_data`.
+        Returns the ciphertext followed by the 16-byte tag.
+        """
+        ciphertext, tag = self._gcm(plaintext, iv, associated_data, True)
+        return ciphertext + tag
+
+    def decrypt_gcm(self, ciphertext, iv, associated_data=b''):
+        """
+        Verifies and decrypts a ciphertext produced by `encrypt_gcm` with the
+        same IV and associated data.
+        """
+        assert len(ciphertext) >= 16, 'Ciphertext must contain a 16-byte tag.'
+        ciphertext, tag = ciphertext[:-16], ciphertext[-16:]
+        plaintext, expected_tag = self._gcm(ciphertext, iv, associated_data, False)
+        assert compare_digest(tag, expected_tag), 'Ciphertext corrupted or tampered.'
+        return plaintext
+
+    def _cmac_subkeys(self):
+        """
+        Returns the cached CMAC subkeys (K1, K2) as integers, see RFC 4493.
+        """
+        if getattr(self, '_cmac_subkeys_cache', None) is None:
+            l = int.from_bytes(self.encrypt_block(bytes(16)), 'big')
+            k1 = cmac_double(l)
+            self._cmac_subkeys_cache = (k1, cmac_double(k1))
+        return self._cmac_subkeys_cache
+
+    def cmac(self, data=b''):
+        """
+        Returns an `AESCMAC` object under this key, fed with `data`.
+        """
+        mac = AESCMAC(self)
+        mac.update(data)
+        return mac
+
+    def cmac_many(self, messages):
+        """
+        Returns the CMAC tags of many messages. With NumPy, block `i` of every
+        message is processed in a single `encrypt_blocks` call, which suits
+        many short records.
+        """
+        messages = [bytes(message) for message in messages]
+        if np is None or not messages:
+            return [self.cmac(message).digest() for message in messages]
+
+        k1, k2 = self._cmac_subkeys()
+        n_blocks = [max(1, -(-len(message) // 16)) for message in messages]
+        width = max(n_blocks) * 16
+        # Longest messages first, so the messages still running at block `i`
+        # are always a prefix of the batch.
+        order = sorted(range(len(messages)), key=lambda i: -n_blocks[i])
+        padded = bytearray()
+        for i in order:
+            message = messages[i]
+            if message and len(message) % 16 == 0:
+                last, subkey = message[-16:], k1
+            else:
+                last, subkey = message[len(message) // 16 * 16:], k2
+                last = last + b'\x80' + bytes(15 - len(last))
+            last = (int.from_bytes(last, 'big') ^ subkey).to_bytes(16, 'big')
+            padded += message[:(n_blocks[i] - 1) * 16] + last + bytes(width - n_blocks[i] * 16)
+
+        blocks = np.frombuffer(bytes(padded), dtype=np.uint8).reshape(len(messages), -1, 16)
+        remaining = np.array([n_blocks[i] for i in order])
+        state = np.zeros((len(messages), 16), dtype=np.uint8)
+        for i in range(blocks.shape[1]):
+            active = int(np.count_nonzero(remaining > i))
+            state[:active] = self.encrypt_blocks(state[:active] ^ blocks[:active, i])
+
+        tags = [None] * len(messages)
+        for position, i in enumerate(order):
+            tags[i] = state[position].tobytes()
+        return tags
+
+import asyncio
+import inspect
+import mmap
 import os
-from hashlib import pbkdf2_hmac
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from hashlib import pbkdf2_hmac, sha256
 from hmac import new as new_hmac, compare_digest
 
 AES_KEY_SIZE = 16
@@ -436,12 +1401,139 @@ IV_SIZE = 16
 SALT_SIZE = 16
 HMAC_SIZE = 32
 
+class LRUCache:
+    """
+    Thread-safe mapping bounded to `maxsize` entries, evicting the least
+    recently used one. Entries older than `ttl` seconds are treated as
+    missing. `on_evict(value)` is called for every value that leaves the
+    cache, so secrets can be wiped.
+    """
+    def __init__(self, maxsize=128, ttl=None, on_evict=None):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, key):
+        _, value = self._entries.pop(key)
+        if self.on_evict is not None:
+            self.on_evict(value)
+
+    def get(self, key, copy=None):
+        """
+        Returns the cached value for `key`, or None. If given, `copy(value)`
+        is returned instead, computed under the lock so it can't race with
+        the eviction of the entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                self._evict(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1] if copy is None else copy(entry[1])
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (time.monotonic(), value)
+            while len(self._entries) > self.maxsize:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._evict(key)
+
+
+def zeroize(buffer):
+    """ Overwrites a mutable buffer with zeros. """
+    buffer[:] = bytes(len(buffer))
+
+def wipe_schedule(schedule):
+    """
+    Overwrites every round key in a (key_matrices, enc_words, dec_words,
+    dec_key_matrices) tuple with zeros.
+    """
+    key_matrices, enc_words, dec_words, dec_key_matrices = schedule
+    for matrix in key_matrices + dec_key_matrices:
+        matrix[:] = [[0] * len(word) for word in matrix]
+    enc_words[:] = [0] * len(enc_words)
+    dec_words[:] = [0] * len(dec_words)
+
+class SharedSchedule:
+    """
+    Expanded key schedule shared by the cache and every `AES.cached` object
+    of one key. `rounds` is never modified while in use: it is wiped only
+    once the schedule has been evicted and the last of those objects is gone.
+    """
+    def __init__(self, key_matrices, enc_words, dec_words, dec_key_matrices):
+        self.rounds = (key_matrices, enc_words, dec_words, dec_key_matrices)
+        weakref.finalize(self, wipe_schedule, self.rounds)
+
+# Process-wide cache of expanded key schedules used by `AES.cached`, keyed by
+# the SHA-256 digest of the key.
+schedule_cache = LRUCache(256)
+
+def configure_schedule_cache(maxsize=256):
+    """
+    Replaces `schedule_cache` with an empty one of `maxsize` entries. The
+    schedules of the old one are wiped once no `AES` object uses them.
+    """
+    global schedule_cache
+    old, schedule_cache = schedule_cache, LRUCache(maxsize)
+    old.clear()
+
+# Opt-in cache of stretched key material, see `enable_key_cache`.
+key_cache = None
+
+def enable_key_cache(maxsize=64, ttl=600):
+    """
+    Caches PBKDF2 results in `get_key_iv`, keyed by (password digest, salt,
+    workload), for at most `ttl` seconds. Evicted key material is zeroed.
+    """
+    global key_cache
+    disable_key_cache()
+    key_cache = LRUCache(maxsize, ttl, on_evict=zeroize)
+
+def disable_key_cache():
+    """
+    Stops caching derived keys and wipes the ones already cached.
+    """
+    global key_cache
+    if key_cache is not None:
+        key_cache.clear()
+    key_cache = None
+
+
 def get_key_iv(password, salt, workload=100000):
     """
     Stretches the password and extracts an AES key, an HMAC key and an AES
     initialization vector.
     """
-    stretched = pbkdf2_hmac('sha256', password, salt, workload, AES_KEY_SIZE + IV_SIZE + HMAC_KEY_SIZE)
+    cache = key_cache
+    if cache is not None:
+        cache_key = (sha256(password).digest(), bytes(salt), workload)
+        # Copied under the cache lock: an eviction from another thread
+        # zeroes the cached bytearray.
+        stretched = cache.get(cache_key, copy=bytes)
+        if stretched is None:
+            stretched = pbkdf2_hmac('sha256', password, salt, workload, AES_KEY_SIZE + IV_SIZE + HMAC_KEY_SIZE)
+            cache.put(cache_key, bytearray(stretched))
+    else:
+        stretched = pbkdf2_hmac('sha256', password, salt, workload, AES_KEY_SIZE + IV_SIZE + HMAC_KEY_SIZE)
     aes_key, stretched = stretched[:AES_KEY_SIZE], stretched[AES_KEY_SIZE:]
     hmac_key, stretched = stretched[:HMAC_KEY_SIZE], stretched[HMAC_KEY_SIZE:]
     iv = stretched[:IV_SIZE]
@@ -497,14 +1589,774 @@ def decrypt(key, ciphertext, workload=100000):
     return AES(key).decrypt_cbc(ciphertext, iv)
 
 
-def benchmark():
-    key = b'P' * 16
-    message = b'M' * 16
-    aes = AES(key)
-    for i in range(30000):
-        aes.encrypt_block(message)
+class AESSession:
+    """
+    Derives the keys for `password` once and then encrypts or decrypts many
+    records with them.
+
+    Records share the session salt, so each one carries its own random IV:
+    HMAC (32 bytes) + salt (16 bytes) + IV (16 bytes) + AES-128-CBC
+    ciphertext. The HMAC covers everything after it.
+    """
+    def __init__(self, password, salt=None, workload=100000):
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        self.salt = os.urandom(SALT_SIZE) if salt is None else salt
+        assert len(self.salt) == SALT_SIZE
+        key, hmac_key, _ = get_key_iv(password, self.salt, workload)
+        self._aes = AES(key)
+        # Keyed once; copies reuse the precomputed inner and outer states.
+        self._hmac = new_hmac(hmac_key, digestmod='sha256')
+
+    def _mac(self, body):
+        mac = self._hmac.copy()
+        mac.update(body)
+        return mac.digest()
+
+    def encrypt(self, plaintext):
+        """
+        Encrypts a single record.
+        """
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode('utf-8')
+
+        iv = os.urandom(IV_SIZE)
+        body = self.salt + iv + self._aes.encrypt_cbc(plaintext, iv)
+        return self._mac(body) + body
+
+    def decrypt(self, record):
+        """
+        Verifies and decrypts a single record produced by this session's
+        password and salt.
+        """
+        assert len(record) >= HMAC_SIZE + SALT_SIZE + IV_SIZE + 16, 'Record too short.'
+        assert len(record) % 16 == 0, "Record must be made of full 16-byte blocks."
+
+        hmac, body = record[:HMAC_SIZE], record[HMAC_SIZE:]
+        assert body[:SALT_SIZE] == self.salt, 'Record was encrypted with a different salt.'
+        assert compare_digest(hmac, self._mac(body)), 'Ciphertext corrupted or tampered.'
+
+        iv, ciphertext = body[SALT_SIZE:SALT_SIZE + IV_SIZE], body[SALT_SIZE + IV_SIZE:]
+        return self._aes.decrypt_cbc(ciphertext, iv)
+
+    def encrypt_many(self, plaintexts):
+        """
+        Yields the encrypted record for each plaintext, in order.
+        """
+        for plaintext in plaintexts:
+            yield self.encrypt(plaintext)
+
+    def decrypt_many(self, records):
+        """
+        Yields the plaintext for each record, in order.
+        """
+        for record in records:
+            yield self.decrypt(record)
 
-__all__ = ["encrypt", "decrypt", "AES"]
+
+def encrypt_many(key, plaintexts, workload=100000, lazy=False):
+    """
+    Encrypts every plaintext in `plaintexts` with a single key derivation,
+    key schedule and HMAC key setup, see `AESSession` for the record format.
+
+    Returns a list, or a generator when `lazy` is true.
+    """
+    records = AESSession(key, workload=workload).encrypt_many(plaintexts)
+    return records if lazy else list(records)
+
+
+def decrypt_many(key, records, workload=100000, lazy=False):
+    """
+    Decrypts records produced by `encrypt_many` or `AESSession`, deriving the
+    keys once per distinct salt.
+
+    Returns a list, or a generator when `lazy` is true.
+    """
+    def generate():
+        sessions = {}
+        for record in records:
+            salt = bytes(record[HMAC_SIZE:HMAC_SIZE + SALT_SIZE])
+            if salt not in sessions:
+                sessions[salt] = AESSession(key, salt, workload)
+            yield sessions[salt].decrypt(record)
+
+    plaintexts = generate()
+    return plaintexts if lazy else list(plaintexts)
+
+
+STREAM_MAGIC = b'AES\x01'
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def open_stream(file, mode):
+    """
+    Returns `(file_object, should_close)` for a path or an open binary file.
+    """
+    if hasattr(file, 'read') or hasattr(file, 'write'):
+        return file, False
+    return open(file, mode), True
+
+def read_exactly(source, size):
+    """
+    Reads up to `size` bytes, only returning less at the end of the stream.
+    """
+    data = source.read(size)
+    while len(data) < size:
+        more = source.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+def chunk_hmac(mac, index, final, ciphertext):
+    """
+    Authenticates one stream chunk together with its position, so chunks
+    cannot be reordered, dropped or truncated.
+    """
+    mac = mac.copy()
+    mac.update(index.to_bytes(8, 'big') + bytes([final]))
+    mac.update(ciphertext)
+    return mac.digest()
+
+STREAM_HEADER_SIZE = len(STREAM_MAGIC) + 4 + SALT_SIZE
+
+def parse_stream_header(header):
+    """
+    Returns `(chunk_size, salt)` from a stream header.
+    """
+    assert len(header) == STREAM_HEADER_SIZE and header.startswith(STREAM_MAGIC), 'Not an AES stream.'
+    chunk_size = int.from_bytes(header[len(STREAM_MAGIC):-SALT_SIZE], 'big')
+    assert chunk_size > 0 and chunk_size % 16 == 0, 'Ciphertext corrupted or tampered.'
+    return chunk_size, header[-SALT_SIZE:]
+
+class StreamCipher:
+    """
+    Encrypts and verifies the chunks of one stream, see `encrypt_stream`.
+    Chunks are independent given their index, so they can be processed in
+    any order or in another process; the object pickles by its keys.
+    """
+    def __init__(self, key, hmac_key, iv, salt, chunk_size):
+        self.key, self.hmac_key, self.iv, self.salt = key, hmac_key, iv, salt
+        self.chunk_size = chunk_size
+        self.aes = AES(key)
+        self.mac = new_hmac(hmac_key, salt, 'sha256')
+
+    def __reduce__(self):
+        return StreamCipher, (self.key, self.hmac_key, self.iv, self.salt, self.chunk_size)
+
+    def _xor_keystream(self, index, src, dst):
+        # CTR counters continue across chunks, chunk i starts at block
+        # i * chunk_size / 16.
+        ctr_xor_into(self.aes, src, dst, self.iv, index * self.chunk_size // 16)
+
+    def seal_into(self, index, final, plaintext, out):
+        """
+        Writes the ciphertext of chunk `index` followed by its HMAC into the
+        writable buffer `out`, of `len(plaintext) + HMAC_SIZE` bytes.
+        """
+        length = len(plaintext)
+        with memoryview(out) as view, view[:length] as ciphertext:
+            self._xor_keystream(index, plaintext, ciphertext)
+            view[length:length + HMAC_SIZE] = chunk_hmac(self.mac, index, final, ciphertext)
+
+    def open_into(self, index, final, chunk, out):
+        """
+        Verifies a chunk written by `seal` and writes its plaintext into the
+        writable buffer `out`, of `len(chunk) - HMAC_SIZE` bytes.
+        """
+        assert len(chunk) >= HMAC_SIZE, 'Ciphertext corrupted or tampered.'
+        length = len(chunk) - HMAC_SIZE
+        with memoryview(chunk) as view, view[:length] as ciphertext:
+            hmac = chunk_hmac(self.mac, index, final, ciphertext)
+            assert compare_digest(view[length:].tobytes(), hmac), 'Ciphertext corrupted or tampered.'
+            self._xor_keystream(index, ciphertext, out)
+
+    def seal(self, index, final, plaintext):
+        """ Returns the ciphertext of chunk `index` followed by its HMAC. """
+        chunk = bytearray(len(plaintext) + HMAC_SIZE)
+        self.seal_into(index, final, plaintext, chunk)
+        return bytes(chunk)
+
+    def open(self, index, final, chunk):
+        """ Verifies a chunk written by `seal` and returns its plaintext. """
+        plaintext = bytearray(max(len(chunk) - HMAC_SIZE, 0))
+        self.open_into(index, final, chunk, plaintext)
+        return bytes(plaintext)
+
+
+def encrypt_stream(key, source, destination, workload=100000, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encrypts everything read from `source` into `destination` with bounded
+    memory, using AES-128 in CTR mode, PBKDF2 to stretch the given key and an
+    HMAC on every chunk. Both arguments may be paths or binary file objects.
+
+    The output is a 24 byte header (magic, chunk size, salt) followed by
+    chunks of `chunk_size` ciphertext bytes, each followed by its HMAC. The
+    last chunk is always shorter than `chunk_size`, possibly empty.
+    """
+    assert chunk_size > 0 and chunk_size % 16 == 0, "Chunk size must be a multiple of 16 bytes."
+
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+
+    salt = os.urandom(SALT_SIZE)
+    cipher = StreamCipher(*get_key_iv(key, salt, workload), salt, chunk_size)
+
+    source, close_source = open_stream(source, 'rb')
+    destination, close_destination = open_stream(destination, 'wb')
+    try:
+        destination.write(STREAM_MAGIC + chunk_size.to_bytes(4, 'big') + salt)
+        index = 0
+        while True:
+            plaintext = read_exactly(source, chunk_size)
+            final = len(plaintext) < chunk_size
+            destination.write(cipher.seal(index, final, plaintext))
+            if final:
+                break
+            index += 1
+    finally:
+        if close_source:
+            source.close()
+        if close_destination:
+            destination.close()
+
+
+def decrypt_stream(key, source, destination, workload=100000):
+    """
+    Decrypts a stream written by `encrypt_stream` from `source` into
+    `destination`. Every chunk is verified before its plaintext is written,
+    so output is produced incrementally with bounded memory.
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+
+    source, close_source = open_stream(source, 'rb')
+    destination, close_destination = open_stream(destination, 'wb')
+    try:
+        chunk_size, salt = parse_stream_header(read_exactly(source, STREAM_HEADER_SIZE))
+
+        cipher = StreamCipher(*get_key_iv(key, salt, workload), salt, chunk_size)
+
+        index = 0
+        while True:
+            chunk = read_exactly(source, chunk_size + HMAC_SIZE)
+            final = len(chunk) < chunk_size + HMAC_SIZE
+            destination.write(cipher.open(index, final, chunk))
+            if final:
+                break
+            index += 1
+    finally:
+        if close_source:
+            source.close()
+        if close_destination:
+            destination.close()
+
+
+class AsyncAESStream:
+    """
+    Encrypts or decrypts between an `asyncio.StreamReader` and
+    `asyncio.StreamWriter` without blocking the event loop, in the format of
+    `encrypt_stream`.
+
+    Key stretching and every chunk run in `executor` (the loop's default
+    executor if None). At most `max_in_flight` chunks are being processed
+    at once; results are written in order, and the writer is drained after
+    each chunk, so a slow consumer holds back reading.
+    """
+    def __init__(self, reader, writer, key, workload=100000, chunk_size=STREAM_CHUNK_SIZE,
+                 executor=None, max_in_flight=4):
+        assert chunk_size > 0 and chunk_size % 16 == 0, "Chunk size must be a multiple of 16 bytes."
+        assert max_in_flight > 0
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        self.reader = reader
+        self.writer = writer
+        self.key = key
+        self.workload = workload
+        self.chunk_size = chunk_size
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+
+    async def _read_exactly(self, size):
+        try:
+            return await self.reader.readexactly(size)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+    async def _cipher(self, salt, chunk_size):
+        loop = asyncio.get_running_loop()
+        keys = await loop.run_in_executor(self.executor, get_key_iv, self.key, salt, self.workload)
+        return StreamCipher(*keys, salt, chunk_size)
+
+    async def _pipeline(self, process, read_size):
+        """
+        Reads chunks of `read_size` bytes and runs `process(index, final,
+        chunk)` on each in the executor, writing the results in order.
+        Returns the number of input bytes.
+        """
+        loop = asyncio.get_running_loop()
+        pending = deque()
+        total = 0
+        try:
+            index = 0
+            while True:
+                chunk = await self._read_exactly(read_size)
+                total += len(chunk)
+                final = len(chunk) < read_size
+                pending.append(loop.run_in_executor(self.executor, process, index, final, chunk))
+                while len(pending) >= self.max_in_flight or (final and pending):
+                    self.writer.write(await pending.popleft())
+                    await self.writer.drain()
+                if final:
+                    return total
+                index += 1
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def encrypt(self):
+        """
+        Encrypts everything from the reader into the writer. Returns the
+        number of plaintext bytes.
+        """
+        salt = os.urandom(SALT_SIZE)
+        cipher = await self._cipher(salt, self.chunk_size)
+        self.writer.write(STREAM_MAGIC + self.chunk_size.to_bytes(4, 'big') + salt)
+        return await self._pipeline(cipher.seal, self.chunk_size)
+
+    async def decrypt(self):
+        """
+        Decrypts a stream from the reader into the writer, verifying every
+        chunk before its plaintext is written. Returns the number of input
+        bytes after the header.
+        """
+        chunk_size, salt = parse_stream_header(await self._read_exactly(STREAM_HEADER_SIZE))
+        cipher = await self._cipher(salt, chunk_size)
+        return await self._pipeline(cipher.open, chunk_size + HMAC_SIZE)
+
+
+def ctr_xor_into(aes, src, dst, iv, first_block):
+    """
+    XORs `src` with the CTR keystream starting `first_block` blocks after
+    `iv` into `dst`, using the batched engine when NumPy is available.
+    """
+    if np is None:
+        counter = (int.from_bytes(iv, 'big') + first_block) % 2**128
+        aes.encrypt_ctr_into(src, dst, counter.to_bytes(16, 'big'))
+        return
+    keystream = aes._ctr_keystream(iv, first_block, (len(src) + 15) // 16)
+    np.bitwise_xor(np.frombuffer(src, dtype=np.uint8), np.frombuffer(keystream, dtype=np.uint8, count=len(src)),
+                   out=np.frombuffer(dst, dtype=np.uint8))
+
+@contextmanager
+def mapped_file(path, size, write):
+    """
+    Memory-maps the first `size` bytes of `path` and yields a memoryview of
+    them, creating or resizing the file first when mapping for writing.
+    Empty files cannot be mapped, so an empty view stands in for them.
+    """
+    if write:
+        with open(path, 'wb') as f:
+            f.truncate(size)
+    if size == 0:
+        yield memoryview(bytearray())
+        return
+    access = mmap.ACCESS_WRITE if write else mmap.ACCESS_READ
+    with open(path, 'r+b' if write else 'rb') as f, mmap.mmap(f.fileno(), size, access=access) as mapping:
+        with memoryview(mapping) as view:
+            yield view
+
+
+def encrypt_file(key, input_path, output_path, workload=100000, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encrypts the file at `input_path` into `output_path` in the
+    `encrypt_stream` format, working directly on memory-mapped views of both
+    files one chunk at a time. Returns the number of plaintext bytes.
+    """
+    assert chunk_size > 0 and chunk_size % 16 == 0, "Chunk size must be a multiple of 16 bytes."
+
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+
+    salt = os.urandom(SALT_SIZE)
+    cipher = StreamCipher(*get_key_iv(key, salt, workload), salt, chunk_size)
+
+    size = os.path.getsize(input_path)
+    n_chunks = size // chunk_size + 1
+    output_size = STREAM_HEADER_SIZE + size + n_chunks * HMAC_SIZE
+    with mapped_file(input_path, size, False) as source, mapped_file(output_path, output_size, True) as destination:
+        destination[:STREAM_HEADER_SIZE] = STREAM_MAGIC + chunk_size.to_bytes(4, 'big') + salt
+        position = STREAM_HEADER_SIZE
+        for index in range(n_chunks):
+            start = index * chunk_size
+            length = min(chunk_size, size - start)
+            with source[start:start + length] as plaintext, destination[position:position + length + HMAC_SIZE] as chunk:
+                cipher.seal_into(index, index == n_chunks - 1, plaintext, chunk)
+            position += length + HMAC_SIZE
+    return size
+
+
+def decrypt_file(key, input_path, output_path, workload=100000):
+    """
+    Decrypts a file written by `encrypt_file` or `encrypt_stream` into
+    `output_path`, working directly on memory-mapped views of both files.
+    Every chunk is verified before it is decrypted; on failure the output
+    file is removed. Returns the number of plaintext bytes.
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+
+    size = os.path.getsize(input_path)
+    assert size >= STREAM_HEADER_SIZE + HMAC_SIZE, 'Ciphertext corrupted or tampered.'
+    with mapped_file(input_path, size, False) as source:
+        chunk_size, salt = parse_stream_header(source[:STREAM_HEADER_SIZE].tobytes())
+        cipher = StreamCipher(*get_key_iv(key, salt, workload), salt, chunk_size)
+
+        # Every chunk but the last is full, the last one is always shorter.
+        n_full, last = divmod(size - STREAM_HEADER_SIZE, chunk_size + HMAC_SIZE)
+        assert last >= HMAC_SIZE, 'Ciphertext corrupted or tampered.'
+        plaintext_size = n_full * chunk_size + last - HMAC_SIZE
+
+        try:
+            with mapped_file(output_path, plaintext_size, True) as destination:
+                position = STREAM_HEADER_SIZE
+                for index in range(n_full + 1):
+                    start = index * chunk_size
+                    length = chunk_size if index < n_full else last - HMAC_SIZE
+                    with source[position:position + length + HMAC_SIZE] as chunk, destination[start:start + length] as plaintext:
+                        cipher.open_into(index, index == n_full, chunk, plaintext)
+                    position += length + HMAC_SIZE
+        except BaseException:
+            os.remove(output_path)
+            raise
+    return plaintext_size
+
+
+class AESXTS:
+    """
+    XTS-AES (IEEE 1619) for length-preserving encryption of independent,
+    randomly accessible sectors. `key` holds the data key followed by the
+    tweak key, 32 or 64 bytes in total. Every sector is encrypted under a
+    tweak derived from its sector number, so each one can be rewritten on its
+    own.
+    """
+    def __init__(self, key):
+        assert len(key) in (32, 64)
+        half = len(key) // 2
+        assert key[:half] != key[half:], 'XTS data and tweak keys must differ.'
+        self.data_cipher = AES(key[:half])
+        self.tweak_cipher = AES(key[half:])
+
+    def _crypt_sector(self, data, sector, encrypting):
+        assert len(data) >= 16, 'XTS sectors must be at least one block long.'
+        crypt_block = self.data_cipher.encrypt_block if encrypting else self.data_cipher.decrypt_block
+        tweak = int.from_bytes(self.tweak_cipher.encrypt_block(sector.to_bytes(16, 'little')), 'little')
+        tweaks = []
+        for _ in range((len(data) + 15) // 16):
+            tweaks.append(tweak.to_bytes(16, 'little'))
+            # Multiply the tweak by the primitive element alpha.
+            tweak = ((tweak << 1) ^ (0x87 if tweak >> 127 else 0)) & (2**128 - 1)
+
+        n_full, tail = divmod(len(data), 16)
+        if tail:
+            # Ciphertext stealing: when decrypting, the last full block uses
+            # the tweak of the partial block and vice versa.
+            if not encrypting:
+                tweaks[n_full - 1], tweaks[n_full] = tweaks[n_full], tweaks[n_full - 1]
+            n_full -= 1
+
+        blocks = [xor_bytes(crypt_block(xor_bytes(block, t)), t) for block, t in zip(split_blocks(data[:16 * n_full]), tweaks)]
+        if tail:
+            last = xor_bytes(crypt_block(xor_bytes(data[16 * n_full:16 * n_full + 16], tweaks[n_full])), tweaks[n_full])
+            stolen = data[16 * n_full + 16:] + last[tail:]
+            blocks.append(xor_bytes(crypt_block(xor_bytes(stolen, tweaks[n_full + 1])), tweaks[n_full + 1]))
+            blocks.append(last[:tail])
+        return b''.join(blocks)
+
+    def encrypt_sector(self, plaintext, sector):
+        """
+        Encrypts one sector (at least 16 bytes) with the tweak for `sector`.
+        """
+        return self._crypt_sector(plaintext, sector, True)
+
+    def decrypt_sector(self, ciphertext, sector):
+        """
+        Decrypts one sector (at least 16 bytes) with the tweak for `sector`.
+        """
+        return self._crypt_sector(ciphertext, sector, False)
+
+    def _crypt_sector_range(self, data, first_sector, sector_size, encrypting):
+        """
+        Encrypts or decrypts consecutive whole sectors, batching every block
+        of every sector through the NumPy engine when possible.
+        """
+        n_sectors = len(data) // sector_size
+        # The batched tweaks only hold 64-bit sector numbers.
+        if np is None or sector_size % 16 or first_sector + n_sectors > 2**64:
+            return b''.join(self._crypt_sector(data[i * sector_size:(i + 1) * sector_size], first_sector + i, encrypting)
+                            for i in range(n_sectors))
+
+        sectors = np.zeros((n_sectors, 2), dtype='<u8')
+        sectors[:, 0] = np.arange(first_sector, first_sector + n_sectors, dtype=np.uint64)
+        tweak = self.tweak_cipher.encrypt_blocks(sectors.view(np.uint8)).view('<u8').astype(np.uint64)
+        low, high = tweak[:, 0], tweak[:, 1]
+
+        blocks_per_sector = sector_size // 16
+        tweaks = np.empty((n_sectors, blocks_per_sector, 2), dtype='<u8')
+        for j in range(blocks_per_sector):
+            tweaks[:, j, 0], tweaks[:, j, 1] = low, high
+            # Multiply every tweak by alpha at once.
+            carry = high >> np.uint64(63)
+            high = (high << np.uint64(1)) | (low >> np.uint64(63))
+            low = (low << np.uint64(1)) ^ (carry * np.uint64(0x87))
+        tweaks = tweaks.view(np.uint8).reshape(-1, 16)
+
+        blocks = np.frombuffer(data, dtype=np.uint8, count=n_sectors * sector_size).reshape(-1, 16) ^ tweaks
+        crypt_blocks = self.data_cipher.encrypt_blocks if encrypting else self.data_cipher.decrypt_blocks
+        return (crypt_blocks(blocks) ^ tweaks).tobytes()
+
+    def _crypt_sectors(self, data, first_sector, sector_size, encrypting, workers, executor):
+        assert sector_size >= 16 and len(data) % sector_size == 0
+        n_sectors = len(data) // sector_size
+        workers = workers or os.cpu_count() or 1
+        tasks = [(data[first * sector_size:(first + count) * sector_size], first_sector + first, sector_size, encrypting)
+                 for first, count in split_ranges(n_sectors, workers)]
+        return run_tasks(self._crypt_sector_range, tasks, workers, executor)
+
+    def encrypt_sectors(self, plaintext, first_sector=0, sector_size=512, workers=1, executor=None):
+        """
+        Encrypts consecutive sectors numbered from `first_sector`. All the
+        sectors are batched through the NumPy engine, and with `workers` > 1
+        split across a pool of processes.
+        """
+        return self._crypt_sectors(plaintext, first_sector, sector_size, True, workers, executor)
+
+    def decrypt_sectors(self, ciphertext, first_sector=0, sector_size=512, workers=1, executor=None):
+        """
+        Decrypts consecutive sectors numbered from `first_sector`.
+        """
+        return self._crypt_sectors(ciphertext, first_sector, sector_size, False, workers, executor)
+
+    def _crypt_image(self, path, sector_size, sectors, encrypting, workers, batch_sectors=4096):
+        size = os.path.getsize(path)
+        assert size % sector_size == 0, 'Image size must be a whole number of sectors.'
+        n_sectors = size // sector_size
+        if size == 0:
+            return
+        with open(path, 'r+b') as f, mmap.mmap(f.fileno(), size) as image:
+            if sectors is not None:
+                for sector in sectors:
+                    assert 0 <= sector < n_sectors
+                    start = sector * sector_size
+                    image[start:start + sector_size] = self._crypt_sector(image[start:start + sector_size], sector, encrypting)
+                return
+            # One pool for the whole image, not one per batch.
+            with ProcessPoolExecutor(workers) if workers > 1 else nullcontext() as executor:
+                for first in range(0, n_sectors, batch_sectors):
+                    start, end = first * sector_size, min(first + batch_sectors, n_sectors) * sector_size
+                    image[start:end] = self._crypt_sectors(image[start:end], first, sector_size, encrypting,
+                                                           workers, executor)
+
+    def encrypt_image(self, path, sector_size=512, sectors=None, workers=1):
+        """
+        Encrypts a disk image in place through a memory map, numbering sectors
+        from the start of the file. When `sectors` is given only those sectors
+        are rewritten and the rest of the image is left untouched.
+        """
+        self._crypt_image(path, sector_size, sectors, True, workers)
+
+    def decrypt_image(self, path, sector_size=512, sectors=None, workers=1):
+        """
+        Decrypts a disk image, or only the given `sectors`, in place.
+        """
+        self._crypt_image(path, sector_size, sectors, False, workers)
+
+
+class AESCMAC:
+    """
+    AES-CMAC (RFC 4493, OMAC1) with the incremental `update`/`digest`
+    interface of `hashlib`. Input is consumed as it arrives, only the last
+    (possibly partial) block is held back until `digest`.
+    """
+    digest_size = 16
+    block_size = 16
+
+    def __init__(self, aes):
+        self.aes = aes
+        self._state = (0, 0, 0, 0)
+        self._buffer = b''
+
+    def update(self, data):
+        data = self._buffer + bytes(data)
+        # Keep the final block, which is mixed with a subkey in `digest`.
+        end = (len(data) - 1) // 16 * 16 if data else 0
+        s0, s1, s2, s3 = self._state
+        encrypt_words = self.aes._encrypt_words
+        for offset in range(0, end, 16):
+            w0, w1, w2, w3 = block_words.unpack_from(data, offset)
+            s0, s1, s2, s3 = encrypt_words(s0 ^ w0, s1 ^ w1, s2 ^ w2, s3 ^ w3)
+        self._state = (s0, s1, s2, s3)
+        self._buffer = data[end:]
+
+    def copy(self):
+        mac = AESCMAC.__new__(AESCMAC)
+        mac.aes, mac._state, mac._buffer = self.aes, self._state, self._buffer
+        return mac
+
+    def digest(self):
+        k1, k2 = self.aes._cmac_subkeys()
+        last = self._buffer
+        if len(last) == 16:
+            subkey = k1
+        else:
+            last, subkey = last + b'\x80' + bytes(15 - len(last)), k2
+        last = int.from_bytes(last, 'big') ^ subkey
+        words = [(last >> shift) & 0xFFFFFFFF for shift in (96, 64, 32, 0)]
+        state = [s ^ w for s, w in zip(self._state, words)]
+        return block_words.pack(*self.aes._encrypt_words(*state))
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+    def verify(self, tag):
+        """ Asserts that `tag` matches the data fed so far. """
+        assert compare_digest(self.digest(), bytes(tag)), 'Message corrupted or tampered.'
+
+
+class Profiler:
+    """
+    Opt-in instrumentation that records call counts and cumulative
+    nanoseconds for each stage of the cipher, and bytes processed by the
+    mode-level methods.
+
+    While enabled, the stage functions and methods are replaced by timing
+    wrappers; `disable` puts the originals back, so a disabled profiler
+    costs nothing. Only one profiler can be enabled at a time. The round
+    function stages are only hit by the 'reference' engine, the 'table'
+    engine shows up as `encrypt_block` and `decrypt_block`.
+
+        with Profiler() as profiler:
+            AES(key, engine='reference').encrypt_cbc(plaintext, iv)
+        profiler.write_collapsed('aes.folded')
+    """
+    # Module level functions, as (stage name, global name).
+    function_stages = (
+        ('sub_bytes', 'flat_sub_bytes'), ('inv_sub_bytes', 'flat_inv_sub_bytes'),
+        ('shift_rows', 'flat_shift_rows'), ('inv_shift_rows', 'flat_inv_shift_rows'),
+        ('mix_columns', 'flat_mix_columns'), ('inv_mix_columns', 'flat_inv_mix_columns'),
+        ('add_round_key', 'flat_add_round_key'), ('xor_bytes', 'xor_bytes'),
+        ('pad', 'pad'), ('unpad', 'unpad'), ('pbkdf2', 'pbkdf2_hmac'),
+        ('hmac', 'new_hmac'), ('hmac', 'chunk_hmac'),
+    )
+    # Methods, as (stage name, class name, method name).
+    method_stages = (
+        ('_expand_key', 'AES', '_expand_key'),
+        ('_expand_decryption_key', 'AES', '_expand_decryption_key'),
+        ('encrypt_block', 'AES', 'encrypt_block'), ('decrypt_block', 'AES', 'decrypt_block'),
+        ('hmac', 'AESSession', '_mac'),
+    )
+    # Mode-level methods, which also count the bytes of their first argument.
+    mode_stages = tuple(direction + '_' + mode
+                        for mode in ('cbc', 'pcbc', 'cfb', 'ofb', 'ctr', 'gcm')
+                        for direction in ('encrypt', 'decrypt'))
+    active = None
+
+    def __init__(self):
+        self.calls = {}
+        self.ns = {}
+        self.bytes = {}
+        self.stacks = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._originals = []
+
+    def _wrap(self, name, function, count_bytes=False):
+        if count_bytes:
+            # The data is the first parameter after `self`, however passed.
+            signature = inspect.signature(function)
+            data_parameter = list(signature.parameters)[1]
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            stack = getattr(self._local, 'stack', None)
+            if stack is None:
+                stack = self._local.stack = []
+            path = stack[-1][0] + ';' + name if stack else name
+            entry = [path, 0]
+            stack.append(entry)
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                with self._lock:
+                    self.calls[name] = self.calls.get(name, 0) + 1
+                    # Recursive stages are only timed at the outermost call.
+                    if (';' + name + ';') not in (';' + path):
+                        self.ns[name] = self.ns.get(name, 0) + elapsed
+                    self.stacks[path] = self.stacks.get(path, 0) + elapsed - entry[1]
+                    if count_bytes:
+                        data = signature.bind_partial(*args, **kwargs).arguments.get(data_parameter)
+                        if data is not None:
+                            self.bytes[name] = self.bytes.get(name, 0) + len(data)
+        return timed
+
+    def enable(self):
+        assert Profiler.active is None, 'Another profiler is already enabled.'
+        Profiler.active = self
+        module = globals()
+        for name, attribute in self.function_stages:
+            self._originals.append((module, attribute, module[attribute]))
+            module[attribute] = self._wrap(name, module[attribute])
+        for name, class_name, method in self.method_stages:
+            cls = module[class_name]
+            self._originals.append((cls, method, cls.__dict__[method]))
+            setattr(cls, method, self._wrap(name, cls.__dict__[method]))
+        for method in self.mode_stages:
+            self._originals.append((AES, method, AES.__dict__[method]))
+            setattr(AES, method, self._wrap(method, AES.__dict__[method], count_bytes=True))
+        return self
+
+    def disable(self):
+        for target, attribute, original in reversed(self._originals):
+            if isinstance(target, dict):
+                target[attribute] = original
+            else:
+                setattr(target, attribute, original)
+        self._originals = []
+        Profiler.active = None
+        return self
+
+    __enter__ = enable
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def report(self):
+        """
+        Returns {stage: {'calls', 'ns', 'bytes'}}, where `ns` includes the
+        time spent in nested stages.
+        """
+        return {name: {'calls': calls, 'ns': self.ns.get(name, 0), 'bytes': self.bytes.get(name, 0)}
+                for name, calls in sorted(self.calls.items())}
+
+    def write_collapsed(self, path):
+        """
+        Writes the recorded stacks in the collapsed format read by
+        flamegraph.pl and speedscope: one `outer;inner nanoseconds` line
+        per distinct stack, counting only time not spent in nested stages.
+        """
+        with open(path, 'w') as f:
+            for stack, ns in sorted(self.stacks.items()):
+                f.write(f'{stack} {ns}\n')
+
+__all__ = ["encrypt", "decrypt", "encrypt_many", "decrypt_many", "encrypt_stream", "decrypt_stream",
+           "encrypt_file", "decrypt_file",
+           "AES", "AESSession", "AESXTS", "AESCMAC", "AsyncAESStream", "enable_key_cache", "disable_key_cache",
+           "configure_schedule_cache", "batch_expand_keys", "batch_encrypt_blocks",
+           "batch_decrypt_blocks", "Profiler"]
 
 if __name__ == '__main__':
     import sys
@@ -516,8 +2368,19 @@ if __name__ == '__main__':
         print('Running tests...')
         from tests import *
         run()
-    elif len(sys.argv) == 2 and sys.argv[1] == 'benchmark':
-        benchmark()
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'benchmark':
+        from benchmark import main
+        exit(main(sys.argv[2:]))
+    elif len(sys.argv) == 3 and sys.argv[1] in ('encrypt-stream', 'decrypt-stream'):
+        stream = encrypt_stream if sys.argv[1] == 'encrypt-stream' else decrypt_stream
+        stream(sys.argv[2], sys.stdin.buffer, sys.stdout.buffer)
+        exit()
+    elif len(sys.argv) == 5 and sys.argv[1] in ('encrypt-file', 'decrypt-file'):
+        process_file = encrypt_file if sys.argv[1] == 'encrypt-file' else decrypt_file
+        start = time.perf_counter()
+        size = process_file(sys.argv[2], sys.argv[3], sys.argv[4])
+        elapsed = time.perf_counter() - start
+        print(f'{size} bytes in {elapsed:.2f} s ({size / elapsed / 1e6:.2f} MB/s)')
         exit()
     elif len(sys.argv) == 3:
         text = read()
@@ -0,0 +1,197 @@
+"""
+Throughput benchmarks for `aes.py`.
+
+Usage: python benchmark.py [--quick] [--sizes 16,1024,...] [--save FILE]
+                           [--baseline FILE] [--tolerance 0.1]
+
+Results are printed as JSON, mapping each case name to its MB/s and ops/s
+(and records/s for encrypt_many/decrypt_many), and each engine to the peak
+memory traced while encrypting 1000 blocks.
+With --baseline, every case slower than the saved ops/s by more than the
+tolerance, and every saved case that was not run, is reported on stderr and
+the exit status is 1.
+"""
+import json
+import sys
+import time
+import tracemalloc
+
+from aes import AES, encrypt, decrypt, encrypt_many, decrypt_many
+
+MODES = ('cbc', 'pcbc', 'cfb', 'ofb', 'ctr')
+KEY_SIZES = (16, 24, 32)
+SIZES = (16, 1024, 64 * 1024, 1024 * 1024, 64 * 1024 * 1024)
+QUICK_SIZES = (16, 1024, 64 * 1024)
+# encrypt_many/decrypt_many derive one key per call; a low PBKDF2 workload
+# keeps the per-record cost in front.
+MANY_RECORDS = 1000
+MANY_WORKLOAD = 1000
+
+
+def measure(function, n_bytes, min_time=0.2, n_records=None):
+    """
+    Calls `function` repeatedly for at least `min_time` seconds and returns
+    its throughput as {'mb_per_s', 'ops_per_s'}, plus 'records_per_s' when
+    every call processes `n_records` records.
+    """
+    ops = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        ops += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+    result = {
+        'mb_per_s': round(ops * n_bytes / elapsed / 1e6, 4),
+        'ops_per_s': round(ops / elapsed, 2),
+    }
+    if n_records is not None:
+        result['records_per_s'] = round(ops * n_records / elapsed, 2)
+    return result
+
+
+def cases(sizes=SIZES, key_sizes=KEY_SIZES, workload=100000):
+    """
+    Yields (name, function, bytes processed per call) for every benchmark.
+    """
+    iv = b'\x01' * 16
+    block = b'M' * 16
+    for key_size in key_sizes:
+        bits = key_size * 8
+        key = b'K' * key_size
+        aes = AES(key)
+        yield f'key-setup/{bits}', lambda key=key: AES(key), key_size
+        yield f'block-encrypt/{bits}', lambda aes=aes: aes.encrypt_block(block), 16
+        yield f'block-decrypt/{bits}', lambda aes=aes: aes.decrypt_block(block), 16
+
+        for mode in MODES:
+            encrypt_mode = getattr(aes, 'encrypt_' + mode)
+            decrypt_mode = getattr(aes, 'decrypt_' + mode)
+            for size in sizes:
+                plaintext = b'M' * size
+                ciphertext = encrypt_mode(plaintext, iv)
+                yield (f'{mode}-encrypt/{bits}/{size}',
+                       lambda f=encrypt_mode, data=plaintext: f(data, iv), size)
+                yield (f'{mode}-decrypt/{bits}/{size}',
+                       lambda f=decrypt_mode, data=ciphertext: f(data, iv), size)
+
+    for size in sizes[:2]:
+        plaintext = b'M' * size
+        ciphertext = encrypt(b'password', plaintext, workload)
+        yield (f'pbkdf2-encrypt/{size}',
+               lambda data=plaintext: encrypt(b'password', data, workload), size)
+        yield (f'pbkdf2-decrypt/{size}',
+               lambda data=ciphertext: decrypt(b'password', data, workload), size)
+
+
+def record_cases(sizes=SIZES):
+    """
+    Yields (name, function, bytes per call, records per call) for the bulk
+    record APIs, on records of up to 1 KB.
+    """
+    for size in [size for size in sizes if size <= 1024][:2]:
+        records = [b'M' * size] * MANY_RECORDS
+        encrypted = encrypt_many(b'password', records, MANY_WORKLOAD)
+        yield (f'encrypt-many/{size}',
+               lambda data=records: encrypt_many(b'password', data, MANY_WORKLOAD),
+               size * MANY_RECORDS, MANY_RECORDS)
+        yield (f'decrypt-many/{size}',
+               lambda data=encrypted: decrypt_many(b'password', data, MANY_WORKLOAD),
+               size * MANY_RECORDS, MANY_RECORDS)
+
+
+def block_allocations(engine='reference', n_blocks=1000):
+    """
+    Returns the peak memory traced by tracemalloc, in bytes, while
+    encrypting `n_blocks` blocks with `encrypt_block_into`. A constant
+    result as `n_blocks` grows means no per-block allocations.
+    """
+    aes = AES(b'K' * 16, engine)
+    block = bytearray(b'M' * 16)
+    aes.encrypt_block_into(block, block)
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        for _ in range(n_blocks):
+            aes.encrypt_block_into(block, block)
+        return tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+
+
+def run(sizes=SIZES, key_sizes=KEY_SIZES, workload=100000, min_time=0.2):
+    """
+    Runs every case and returns {name: {'mb_per_s', 'ops_per_s'}}.
+    """
+    results = {name: measure(function, n_bytes, min_time)
+               for name, function, n_bytes in cases(sizes, key_sizes, workload)}
+    for name, function, n_bytes, n_records in record_cases(sizes):
+        results[name] = measure(function, n_bytes, min_time, n_records)
+    for engine in AES.engines:
+        results[f'allocations/{engine}'] = {'peak_bytes': block_allocations(engine)}
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Returns a list of (name, baseline ops/s, current ops/s) for every case
+    that got slower than `baseline` by more than `tolerance`.
+    """
+    regressions = []
+    for name, expected in sorted(baseline.items()):
+        current = results.get(name)
+        if current is None or 'ops_per_s' not in expected:
+            continue
+        if current['ops_per_s'] < expected['ops_per_s'] * (1 - tolerance):
+            regressions.append((name, expected['ops_per_s'], current['ops_per_s']))
+    return regressions
+
+
+def missing(results, baseline):
+    """
+    Returns the sorted names of the `baseline` cases absent from `results`.
+    """
+    return sorted(name for name in baseline if name not in results)
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmarks aes.py and prints the results as JSON.')
+    parser.add_argument('--quick', action='store_true', help='only run messages up to 64 KB')
+    parser.add_argument('--sizes', help='comma separated message sizes in bytes')
+    parser.add_argument('--workload', type=int, default=100000, help='PBKDF2 iterations')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds spent per case')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown, as a fraction')
+    args = parser.parse_args(argv)
+
+    if args.sizes:
+        sizes = tuple(int(size) for size in args.sizes.split(','))
+    else:
+        sizes = QUICK_SIZES if args.quick else SIZES
+
+    results = run(sizes, KEY_SIZES, args.workload, args.min_time)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, expected, current in regressions:
+            print(f'REGRESSION {name}: {current:.2f} ops/s, baseline {expected:.2f} ops/s '
+                  f'({current / expected - 1:+.0%})', file=sys.stderr)
+        absent = missing(results, baseline)
+        for name in absent:
+            print(f'MISSING {name}: in the baseline but not run', file=sys.stderr)
+        if regressions or absent:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,5 +1,24 @@
 import unittest
-from aes import AES, encrypt, decrypt
+from hashlib import sha256
+from aes import AES, AESSession, AESXTS, encrypt, decrypt, encrypt_many, decrypt_many, encrypt_stream, decrypt_stream
+from aes import encrypt_file, decrypt_file
+from aes import inv_mix_columns
+import aes
+import asyncio
+import benchmark
+import contextlib
+import json
+import io
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class TestBlock(unittest.TestCase):
     """
@@ -67,6 +86,82 @@ class TestKeySizes(unittest.TestCase):
         self.assertEqual(aes.decrypt_block(ciphertext), message)
 
 
+class TestEngines(unittest.TestCase):
+    """
+    Tests the table engine against the reference round functions.
+    """
+    def test_engines_agree(self):
+        for key_size in (16, 24, 32):
+            key = bytes(range(key_size))
+            table = AES(key)
+            reference = AES(key, engine='reference')
+            for i in range(20):
+                block = bytes((i * 17 + j * 31) & 0xFF for j in range(16))
+                ciphertext = table.encrypt_block(block)
+                self.assertEqual(ciphertext, reference.encrypt_block(block))
+                self.assertEqual(table.decrypt_block(ciphertext), block)
+                self.assertEqual(reference.decrypt_block(ciphertext), block)
+
+    def test_decryption_schedule(self):
+        """ The equivalent inverse cipher schedule, FIPS-197 Sec 5.3.5. """
+        aes = AES(bytes(range(16)))
+        n = aes.n_rounds
+        self.assertEqual(aes._dec_words[:4], aes._enc_words[-4:])
+        self.assertEqual(aes._dec_words[-4:], aes._enc_words[:4])
+        for i in range(1, n):
+            matrix = [list(word) for word in aes._key_matrices[n - i]]
+            inv_mix_columns(matrix)
+            self.assertEqual(aes._dec_key_matrices[i], matrix)
+
+    def test_block_into(self):
+        for engine in AES.engines:
+            aes = AES(bytes(range(24)), engine=engine)
+            buffer = bytearray(b'message 16 bytes')
+            aes.encrypt_block_into(buffer, buffer)
+            self.assertEqual(buffer, aes.encrypt_block(b'message 16 bytes'))
+            out = bytearray(20)
+            aes.decrypt_block_into(buffer, memoryview(out))
+            self.assertEqual(out, b'message 16 bytes' + bytes(4))
+
+    def test_bad_engine(self):
+        with self.assertRaises(AssertionError):
+            AES(b'\x00' * 16, engine='fast')
+
+@unittest.skipIf(np is None, 'NumPy is not installed')
+class TestBatch(unittest.TestCase):
+    """
+    Tests the batched NumPy engine against the single block engine.
+    """
+    def test_matches_single_blocks(self):
+        for key_size in (16, 24, 32):
+            aes = AES(bytes(range(key_size)))
+            blocks = np.arange(64 * 16, dtype=np.uint32).reshape(64, 16).astype(np.uint8) * 7
+            ciphertext = aes.encrypt_blocks(blocks)
+            for block, expected in zip(blocks, ciphertext):
+                self.assertEqual(aes.encrypt_block(bytes(block)), bytes(expected))
+            self.assertTrue((aes.decrypt_blocks(ciphertext) == blocks).all())
+
+    def test_expected_value(self):
+        message = np.frombuffer(b'\x32\x43\xF6\xA8\x88\x5A\x30\x8D\x31\x31\x98\xA2\xE0\x37\x07\x34', dtype=np.uint8)
+        aes = AES(b'\x2B\x7E\x15\x16\x28\xAE\xD2\xA6\xAB\xF7\x15\x88\x09\xCF\x4F\x3C')
+        ciphertext = aes.encrypt_blocks(message.reshape(1, 16))
+        self.assertEqual(ciphertext.tobytes(), b'\x39\x25\x84\x1D\x02\xDC\x09\xFB\xDC\x11\x85\x97\x19\x6A\x0B\x32')
+
+    def test_bad_shape(self):
+        with self.assertRaises(AssertionError):
+            AES(b'\x00' * 16).encrypt_blocks(np.zeros((4, 8), dtype=np.uint8))
+
+    def test_many_keys(self):
+        for key_size in (16, 24, 32):
+            keys = np.arange(20 * key_size, dtype=np.uint32).reshape(20, key_size).astype(np.uint8) * 13
+            blocks = np.arange(20 * 16, dtype=np.uint32).reshape(20, 16).astype(np.uint8) * 5
+            schedule = aes.batch_expand_keys(keys)
+            self.assertEqual(schedule.shape, (20, AES.rounds_by_key_size[key_size] + 1, 16))
+            ciphertext = aes.batch_encrypt_blocks(schedule, blocks)
+            for key, block, expected in zip(keys, blocks, ciphertext):
+                self.assertEqual(AES(bytes(key)).encrypt_block(bytes(block)), bytes(expected))
+            self.assertTrue((aes.batch_decrypt_blocks(keys, ciphertext) == blocks).all())
+
 class TestCbc(unittest.TestCase):
     """
     Tests AES-128 in CBC mode.
@@ -348,6 +443,271 @@ class TestCtr(unittest.TestCase):
         ciphertext = self.aes.encrypt_ctr(long_message, self.iv)
         self.assertEqual(self.aes.decrypt_ctr(ciphertext, self.iv), long_message)
 
+class TestInto(unittest.TestCase):
+    """
+    Tests the modes writing into caller-supplied buffers.
+    """
+    def setUp(self):
+        self.aes = AES(b'\x00' * 16)
+        self.iv = b'\x01' * 16
+        self.messages = (b'', b'my message', b'M' * 16, b'M' * 100)
+
+    def test_stream_modes(self):
+        for mode in ('cfb', 'ofb', 'ctr'):
+            encrypt_into = getattr(self.aes, 'encrypt_%s_into' % mode)
+            decrypt_into = getattr(self.aes, 'decrypt_%s_into' % mode)
+            for message in self.messages:
+                dst = bytearray(len(message))
+                self.assertEqual(encrypt_into(message, dst, self.iv), len(message))
+                self.assertEqual(bytes(dst), getattr(self.aes, 'encrypt_' + mode)(message, self.iv))
+                # Decrypt in place.
+                self.assertEqual(decrypt_into(dst, dst, self.iv), len(message))
+                self.assertEqual(bytes(dst), message)
+
+    def test_cbc(self):
+        for message in self.messages:
+            dst = bytearray(len(message) + 16)
+            written = self.aes.encrypt_cbc_into(message, dst, self.iv)
+            self.assertEqual(bytes(dst[:written]), self.aes.encrypt_cbc(message, self.iv))
+            length = self.aes.decrypt_cbc_into(memoryview(dst)[:written], dst, self.iv)
+            self.assertEqual(bytes(dst[:length]), message)
+
+    def test_small_buffer(self):
+        with self.assertRaises(AssertionError):
+            self.aes.encrypt_cbc_into(b'M' * 16, bytearray(16), self.iv)
+
+        with self.assertRaises(AssertionError):
+            self.aes.encrypt_ctr_into(b'M' * 16, bytearray(15), self.iv)
+
+class TestCtrParallel(unittest.TestCase):
+    """
+    Tests that parallel CTR mode matches the serial implementation.
+    """
+    def setUp(self):
+        self.aes = AES(b'\x00' * 16)
+
+    def test_matches_serial(self):
+        message = bytes(range(256)) * 4 + b'tail'
+        for iv in (b'\x01' * 16, b'\xff' * 16, b'\x00' * 8 + b'\xff' * 8):
+            ciphertext = self.aes.encrypt_ctr_parallel(message, iv, workers=3)
+            self.assertEqual(ciphertext, self.aes.encrypt_ctr(message, iv))
+            self.assertEqual(self.aes.decrypt_ctr_parallel(ciphertext, iv, workers=3), message)
+
+    def test_short_message(self):
+        iv = b'\x01' * 16
+        for message in (b'', b'M', b'M' * 16):
+            self.assertEqual(self.aes.encrypt_ctr_parallel(message, iv), self.aes.encrypt_ctr(message, iv))
+
+    def test_wrong_iv(self):
+        with self.assertRaises(AssertionError):
+            self.aes.encrypt_ctr_parallel(b'my message', b'short iv')
+
+class TestCtrRange(unittest.TestCase):
+    """
+    Tests random-access CTR decryption.
+    """
+    def setUp(self):
+        self.aes = AES(b'\x00' * 16)
+        self.iv = b'\x00' * 8 + b'\xff' * 8
+        self.message = bytes(range(256)) * 3
+        self.ciphertext = self.aes.encrypt_ctr(self.message, self.iv)
+
+    def test_ranges(self):
+        for offset, length in ((0, 16), (5, 3), (15, 2), (16, 32), (100, 301), (760, 100), (800, 10)):
+            plaintext = self.aes.decrypt_ctr_range(self.ciphertext, self.iv, offset, length)
+            self.assertEqual(plaintext, self.message[offset:offset + length])
+
+    def test_file(self):
+        f = io.BytesIO(self.ciphertext)
+        plaintext = self.aes.decrypt_ctr_range(f, self.iv, 250, 40)
+        self.assertEqual(plaintext, self.message[250:290])
+
+class TestParallelDecrypt(unittest.TestCase):
+    """
+    Tests that batched CBC and CFB decryption match the serial versions.
+    """
+    def setUp(self):
+        self.aes = AES(b'\x00' * 16)
+        self.iv = b'\x01' * 16
+
+    def test_cbc(self):
+        for message in (b'', b'my message', b'M' * 16, bytes(range(256)) * 3):
+            ciphertext = self.aes.encrypt_cbc(message, self.iv)
+            self.assertEqual(self.aes.decrypt_cbc_parallel(ciphertext, self.iv), message)
+            self.assertEqual(self.aes.decrypt_cbc_parallel(ciphertext, self.iv, workers=3), message)
+
+    def test_cfb(self):
+        for message in (b'', b'my message', b'M' * 16, bytes(range(256)) * 3 + b'tail'):
+            ciphertext = self.aes.encrypt_cfb(message, self.iv)
+            self.assertEqual(self.aes.decrypt_cfb_parallel(ciphertext, self.iv), message)
+            self.assertEqual(self.aes.decrypt_cfb_parallel(ciphertext, self.iv, workers=3), message)
+
+    def test_wrong_iv(self):
+        ciphertext = self.aes.encrypt_cbc(b'my message', self.iv)
+        with self.assertRaises(AssertionError):
+            self.aes.decrypt_cbc_parallel(ciphertext, b'short iv')
+
+        with self.assertRaises(AssertionError):
+            self.aes.decrypt_cfb_parallel(ciphertext, b'long iv' * 16)
+
+class TestGcm(unittest.TestCase):
+    """
+    Tests AES in GCM mode, with vectors from the GCM specification.
+    """
+    def setUp(self):
+        self.aes = AES(bytes.fromhex('feffe9928665731c6d6a8f9467308308'))
+        self.iv = bytes.fromhex('cafebabefacedbaddecaf888')
+        self.associated_data = bytes.fromhex('feedfacedeadbeeffeedfacedeadbeefabaddad2')
+        self.message = bytes.fromhex(
+            'd9313225f88406e5a55909c5aff5269a86a7a9531534f7da2e4c303d8a318a72'
+            '1c3c0c95956809532fcf0e2449a6b525b16aedf5aa0de657ba637b39')
+
+    def test_expected_value(self):
+        ciphertext = AES(bytes(16)).encrypt_gcm(bytes(16), bytes(12))
+        self.assertEqual(ciphertext.hex(), '0388dace60b6a392f328c2b971b2fe78ab6e47d42cec13bdf53a67b21257bddf')
+
+    def test_expected_value_associated_data(self):
+        ciphertext = self.aes.encrypt_gcm(self.message, self.iv, self.associated_data)
+        self.assertEqual(ciphertext.hex(),
+            '42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e'
+            '21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091'
+            '5bc94fbc3221a5db94fae95ae7121a47')
+        self.assertEqual(self.aes.decrypt_gcm(ciphertext, self.iv, self.associated_data), self.message)
+
+    def test_other_iv_sizes(self):
+        for iv in (b'\x01' * 8, b'\x01' * 16, b'\x01' * 60):
+            ciphertext = self.aes.encrypt_gcm(self.message, iv)
+            self.assertEqual(self.aes.decrypt_gcm(ciphertext, iv), self.message)
+
+    def test_integrity(self):
+        ciphertext = self.aes.encrypt_gcm(self.message, self.iv, self.associated_data)
+        with self.assertRaises(AssertionError):
+            self.aes.decrypt_gcm(bytes([ciphertext[0] ^ 1]) + ciphertext[1:], self.iv, self.associated_data)
+
+        with self.assertRaises(AssertionError):
+            self.aes.decrypt_gcm(ciphertext, self.iv, b'other data')
+
+        with self.assertRaises(AssertionError):
+            self.aes.decrypt_gcm(ciphertext[:15], self.iv)
+
+class TestCmac(unittest.TestCase):
+    """
+    Tests AES-CMAC against the RFC 4493 examples.
+    """
+    key = bytes.fromhex('2b7e151628aed2a6abf7158809cf4f3c')
+    message = bytes.fromhex('6bc1bee22e409f96e93d7e117393172aae2d8a571e03ac9c9eb76fac45af8e51'
+                            '30c81c46a35ce411e5fbc1191a0a52eff69f2445df4f9b17ad2b417be66c3710')
+    tags = {
+        0: 'bb1d6929e95937287fa37d129b756746',
+        16: '070a16b46b4d4144f79bdd9dd04a287c',
+        40: 'dfa66747de9ae63030ca32611497c827',
+        64: '51f0bebf7e3b9d92fc49741779363cfe',
+    }
+
+    def test_expected_values(self):
+        aes = AES(self.key)
+        for length, tag in self.tags.items():
+            self.assertEqual(aes.cmac(self.message[:length]).hexdigest(), tag)
+
+    def test_incremental(self):
+        mac = AES(self.key).cmac()
+        for i in range(0, 64, 5):
+            mac.update(self.message[i:i + 5])
+            if i + 5 == 40:
+                self.assertEqual(mac.copy().hexdigest(), self.tags[40])
+        self.assertEqual(mac.hexdigest(), self.tags[64])
+        mac.verify(bytes.fromhex(self.tags[64]))
+        with self.assertRaises(AssertionError):
+            mac.verify(bytes(16))
+
+    def test_many(self):
+        aes = AES(self.key)
+        messages = [self.message[:length] for length in (40, 0, 64, 16, 17, 3)]
+        self.assertEqual(aes.cmac_many(messages), [aes.cmac(message).digest() for message in messages])
+        self.assertEqual(aes.cmac_many([]), [])
+
+
+class TestXts(unittest.TestCase):
+    """
+    Tests XTS-AES sector encryption.
+    """
+    def setUp(self):
+        self.xts = AESXTS(b'\x11' * 16 + b'\x22' * 16)
+        self.data = bytes(range(256)) * 8
+
+    def test_expected_value(self):
+        """ Vector 2 from IEEE 1619, Appendix B. """
+        ciphertext = self.xts.encrypt_sector(b'\x44' * 32, 0x3333333333)
+        self.assertEqual(ciphertext.hex(), 'c454185e6a16936e39334038acef838bfb186fff7480adc4289382ecd6d394f0')
+        self.assertEqual(self.xts.decrypt_sector(ciphertext, 0x3333333333), b'\x44' * 32)
+
+    def test_ciphertext_stealing(self):
+        for length in (17, 31, 33, 100):
+            ciphertext = self.xts.encrypt_sector(self.data[:length], 5)
+            self.assertEqual(len(ciphertext), length)
+            self.assertEqual(self.xts.decrypt_sector(ciphertext, 5), self.data[:length])
+
+    def test_sectors_match_single(self):
+        ciphertext = self.xts.encrypt_sectors(self.data, first_sector=7)
+        expected = b''.join(self.xts.encrypt_sector(self.data[i:i + 512], 7 + i // 512) for i in range(0, len(self.data), 512))
+        self.assertEqual(ciphertext, expected)
+        self.assertEqual(self.xts.encrypt_sectors(self.data, 7, workers=3), expected)
+        self.assertEqual(self.xts.decrypt_sectors(ciphertext, 7, workers=3), self.data)
+
+    def test_sectors_past_64_bits(self):
+        """ Sector numbers past 2**64 fall back to the single-sector path. """
+        first = 2**64 - 2
+        ciphertext = self.xts.encrypt_sectors(self.data, first)
+        expected = b''.join(self.xts.encrypt_sector(self.data[i:i + 512], first + i // 512) for i in range(0, len(self.data), 512))
+        self.assertEqual(ciphertext, expected)
+        self.assertEqual(self.xts.encrypt_sectors(self.data, first, workers=2), expected)
+        self.assertEqual(self.xts.decrypt_sectors(ciphertext, first), self.data)
+
+    def test_image(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'image')
+            with open(path, 'wb') as f:
+                f.write(self.data)
+            self.xts.encrypt_image(path)
+            with open(path, 'rb') as f:
+                encrypted = f.read()
+            self.assertEqual(encrypted, self.xts.encrypt_sectors(self.data))
+
+            # Only the requested sector is rewritten.
+            self.xts.decrypt_image(path, sectors=[2])
+            with open(path, 'rb') as f:
+                image = f.read()
+            self.assertEqual(image[1024:1536], self.data[1024:1536])
+            self.assertEqual(image[:1024] + image[1536:], encrypted[:1024] + encrypted[1536:])
+
+    def test_image_single_pool(self):
+        pools = []
+
+        class CountingPool(ProcessPoolExecutor):
+            def __init__(self, *args):
+                pools.append(self)
+                super().__init__(*args)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'image')
+            with open(path, 'wb') as f:
+                f.write(self.data)
+            original, aes.ProcessPoolExecutor = aes.ProcessPoolExecutor, CountingPool
+            try:
+                self.xts._crypt_image(path, 512, None, True, workers=2, batch_sectors=2)
+            finally:
+                aes.ProcessPoolExecutor = original
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), self.xts.encrypt_sectors(self.data))
+        self.assertEqual(len(pools), 1)
+
+    def test_bad_key(self):
+        with self.assertRaises(AssertionError):
+            AESXTS(b'\x11' * 16)
+
+        with self.assertRaises(AssertionError):
+            AESXTS(b'\x11' * 32)
+
 class TestFunctions(unittest.TestCase):
     """
     Tests the module functions `encrypt` and `decrypt`, as well as basic
@@ -402,6 +762,439 @@ class TestFunctions(unittest.TestCase):
             ciphertext = ciphertext[:-1] + b'a'
             self.decrypt(self.key, ciphertext)
 
+class TestKeyCache(unittest.TestCase):
+    """
+    Tests the opt-in derived key cache used by `get_key_iv`.
+    """
+    def tearDown(self):
+        aes.disable_key_cache()
+
+    def test_hits(self):
+        aes.enable_key_cache()
+        ciphertext = encrypt(b'master key', b'secret message', 1000)
+        self.assertEqual(decrypt(b'master key', ciphertext, 1000), b'secret message')
+        self.assertEqual(decrypt(b'master key', ciphertext, 1000), b'secret message')
+        self.assertEqual(aes.key_cache.hits, 2)
+        self.assertEqual(aes.get_key_iv(b'master key', b'salt', 1000), aes.get_key_iv(b'master key', b'salt', 1000))
+        # A different workload derives different keys.
+        self.assertNotEqual(aes.get_key_iv(b'master key', b'salt', 1000), aes.get_key_iv(b'master key', b'salt', 1001))
+
+    def test_concurrent_eviction(self):
+        """ An entry evicted by another thread right after a hit is still returned intact. """
+        aes.enable_key_cache()
+        expected = aes.get_key_iv(b'master key', b'salt', 1000)
+        cache = aes.key_cache
+        get = cache.get
+
+        def get_then_evict(*args, **kwargs):
+            value = get(*args, **kwargs)
+            evictor = threading.Thread(target=cache.clear)
+            evictor.start()
+            evictor.join()
+            return value
+
+        cache.get = get_then_evict
+        self.assertEqual(aes.get_key_iv(b'master key', b'salt', 1000), expected)
+        self.assertEqual(len(cache), 0)
+
+    def test_eviction_zeroizes(self):
+        evicted = []
+        cache = aes.LRUCache(maxsize=2, on_evict=lambda value: (aes.zeroize(value), evicted.append(value)))
+        values = [bytearray(b'key %d' % i) for i in range(3)]
+        for i, value in enumerate(values):
+            cache.put(i, value)
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.get(2), b'key 2')
+        self.assertEqual(evicted, [bytearray(5)])
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        cache = aes.LRUCache(maxsize=2, ttl=-1)
+        cache.put('key', b'value')
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(len(cache), 0)
+
+class TestScheduleCache(unittest.TestCase):
+    """
+    Tests the process-wide key schedule cache behind `AES.cached`.
+    """
+    def setUp(self):
+        aes.configure_schedule_cache(maxsize=2)
+
+    def tearDown(self):
+        aes.configure_schedule_cache()
+
+    def test_hits(self):
+        key = bytes(range(32))
+        first = AES.cached(key)
+        second = AES.cached(key, engine='reference')
+        self.assertEqual((aes.schedule_cache.hits, aes.schedule_cache.misses), (1, 1))
+        self.assertEqual(second.engine, 'reference')
+        self.assertEqual(second._enc_words, AES(key)._enc_words)
+        self.assertEqual(first.encrypt_block(b'\x00' * 16), second.encrypt_block(b'\x00' * 16))
+        self.assertEqual(second.decrypt_block(first.encrypt_block(b'message 16 bytes')), b'message 16 bytes')
+
+    def test_shared(self):
+        key = bytes(range(16))
+        first, second = AES.cached(key), AES.cached(key)
+        self.assertIs(first._enc_words, second._enc_words)
+        self.assertIs(first._dec_key_matrices, second._dec_key_matrices)
+
+    def test_eviction_wipes(self):
+        keys = [bytes([i]) * 16 for i in range(3)]
+        instances = [AES.cached(key) for key in keys]
+        self.assertEqual(len(aes.schedule_cache), 2)
+        self.assertIsNone(aes.schedule_cache.get(sha256(keys[0]).digest()))
+        # Evicted schedules stay intact while an object still uses them.
+        self.assertEqual(instances[0]._enc_words, AES(keys[0])._enc_words)
+
+        _, enc_words, dec_words, dec_key_matrices = instances[2]._schedule.rounds
+        aes.configure_schedule_cache()
+        self.assertEqual(instances[2]._dec_words, AES(keys[2])._dec_words)
+        del instances
+        self.assertEqual(set(enc_words), {0})
+        self.assertEqual(set(dec_words), {0})
+        self.assertEqual({b for matrix in dec_key_matrices for word in matrix for b in word}, {0})
+
+
+class TestProfiler(unittest.TestCase):
+    """
+    Tests the opt-in per-stage instrumentation.
+    """
+    def test_stages(self):
+        cipher = AES(b'\x00' * 16, engine='reference')
+        with aes.Profiler() as profiler:
+            ciphertext = cipher.encrypt_cbc(b'M' * 40, b'\x01' * 16)
+        report = profiler.report()
+        self.assertEqual(report['encrypt_cbc']['calls'], 1)
+        self.assertEqual(report['encrypt_cbc']['bytes'], 40)
+        self.assertEqual(report['encrypt_block']['calls'], 3)
+        self.assertEqual(report['sub_bytes']['calls'], 3 * 10)
+        self.assertEqual(report['pad']['calls'], 1)
+        self.assertGreaterEqual(report['encrypt_cbc']['ns'], report['encrypt_block']['ns'])
+        self.assertIn('encrypt_cbc;encrypt_block;mix_columns', profiler.stacks)
+
+        # Disabling restores the original functions.
+        self.assertNotIn('__wrapped__', vars(aes.flat_sub_bytes))
+        self.assertNotIn('__wrapped__', vars(AES.encrypt_cbc))
+        self.assertEqual(cipher.encrypt_cbc(b'M' * 40, b'\x01' * 16), ciphertext)
+
+    def test_inverse_stages(self):
+        """ Decryption only reports the inverse round functions. """
+        cipher = AES(b'\x00' * 16, engine='reference')
+        with aes.Profiler() as profiler:
+            cipher.decrypt_block(b'\x00' * 16)
+        report = profiler.report()
+        self.assertEqual(report['inv_shift_rows']['calls'], 10)
+        self.assertEqual(report['inv_mix_columns']['calls'], 9)
+        self.assertNotIn('shift_rows', report)
+        self.assertNotIn('mix_columns', report)
+
+    def test_keyword_arguments(self):
+        cipher = AES(b'\x00' * 16)
+        with aes.Profiler() as profiler:
+            ciphertext = cipher.encrypt_ctr(plaintext=b'abc', iv=b'\x01' * 16)
+            cipher.decrypt_ctr(ciphertext, iv=b'\x01' * 16)
+        report = profiler.report()
+        self.assertEqual(report['encrypt_ctr']['bytes'], 3)
+        self.assertEqual(report['decrypt_ctr']['bytes'], 3)
+
+    def test_password_wrappers(self):
+        with aes.Profiler() as profiler:
+            decrypt(b'key', encrypt(b'key', b'message', 10), 10)
+        report = profiler.report()
+        self.assertEqual(report['hmac']['calls'], 2)
+        self.assertEqual(report['pbkdf2']['calls'], 2)
+        self.assertEqual(report['decrypt_cbc']['bytes'], 16)
+
+    def test_collapsed(self):
+        with aes.Profiler() as profiler:
+            AES(b'\x00' * 16).encrypt_ctr(b'M' * 32, b'\x01' * 16)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'aes.folded')
+            profiler.write_collapsed(path)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        stacks = dict(line.rsplit(' ', 1) for line in lines)
+        self.assertIn('encrypt_ctr;encrypt_block', stacks)
+        self.assertTrue(all(int(ns) >= 0 for ns in stacks.values()))
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Tests the benchmark runner and its baseline comparison.
+    """
+    def test_run(self):
+        results = benchmark.run(sizes=(16, 48), key_sizes=(16,), workload=10, min_time=0)
+        self.assertIn('ctr-decrypt/128/48', results)
+        self.assertIn('key-setup/128', results)
+        self.assertIn('pbkdf2-encrypt/16', results)
+        self.assertGreater(results['encrypt-many/16']['records_per_s'], 0)
+        self.assertGreater(results['decrypt-many/48']['records_per_s'], 0)
+        self.assertTrue(all(result['ops_per_s'] > 0 for name, result in results.items()
+                            if not name.startswith('allocations/')))
+
+    def test_no_block_allocations(self):
+        """ The reference engine reuses its state, so memory doesn't grow with blocks. """
+        few = benchmark.block_allocations('reference', 10)
+        many = benchmark.block_allocations('reference', 2000)
+        self.assertLess(many, 1024)
+        self.assertLessEqual(many - few, 64)
+
+    def test_compare(self):
+        baseline = {'a': {'mb_per_s': 1, 'ops_per_s': 100}, 'b': {'mb_per_s': 1, 'ops_per_s': 100}}
+        results = {'a': {'mb_per_s': 1, 'ops_per_s': 95}, 'b': {'mb_per_s': 1, 'ops_per_s': 50}}
+        self.assertEqual(benchmark.compare(results, baseline, tolerance=0.1), [('b', 100, 50)])
+
+    def test_regression_fails(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            with open(path, 'w') as f:
+                json.dump({'key-setup/128': {'mb_per_s': 1, 'ops_per_s': 1e12}}, f)
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()) as err:
+                status = benchmark.main(['--sizes', '16', '--workload', '1', '--min-time', '0',
+                                         '--baseline', path])
+        self.assertEqual(status, 1)
+        self.assertIn('REGRESSION key-setup/128', err.getvalue())
+
+    def test_missing_fails(self):
+        self.assertEqual(benchmark.missing({'a': {}}, {'a': {}, 'c': {}, 'b': {}}), ['b', 'c'])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            with open(path, 'w') as f:
+                json.dump({'key-setup/1024': {'mb_per_s': 1, 'ops_per_s': 1}}, f)
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()) as err:
+                status = benchmark.main(['--sizes', '16', '--workload', '1', '--min-time', '0',
+                                         '--baseline', path])
+        self.assertEqual(status, 1)
+        self.assertIn('MISSING key-setup/1024', err.getvalue())
+
+
+class TestSession(unittest.TestCase):
+    """
+    Tests encrypting many records with a single key derivation.
+    """
+    def setUp(self):
+        self.session = AESSession(b'master key', workload=1000)
+
+    def test_success(self):
+        for message in (b'', b'secret message', b'M' * 100):
+            record = self.session.encrypt(message)
+            self.assertEqual(self.session.decrypt(record), message)
+
+    def test_same_salt(self):
+        other = AESSession(b'master key', self.session.salt, workload=1000)
+        self.assertEqual(other.decrypt(self.session.encrypt(b'secret message')), b'secret message')
+
+    def test_randomization(self):
+        self.assertNotEqual(self.session.encrypt(b'secret message'), self.session.encrypt(b'secret message'))
+
+    def test_integrity(self):
+        record = self.session.encrypt(b'secret message')
+        with self.assertRaises(AssertionError):
+            self.session.decrypt(record[:-1] + bytes([record[-1] ^ 1]))
+
+        with self.assertRaises(AssertionError):
+            AESSession(b'other key', self.session.salt, workload=1000).decrypt(record)
+
+class TestMany(unittest.TestCase):
+    """
+    Tests the bulk record functions `encrypt_many` and `decrypt_many`.
+    """
+    def setUp(self):
+        self.key = b'master key'
+        self.messages = [b'record %d' % i for i in range(20)] + [b'', b'M' * 100]
+
+    def test_success(self):
+        records = encrypt_many(self.key, self.messages, 1000)
+        self.assertEqual(len(records), len(self.messages))
+        self.assertEqual(decrypt_many(self.key, records, 1000), self.messages)
+
+    def test_lazy(self):
+        records = encrypt_many(self.key, iter(self.messages), 1000, lazy=True)
+        self.assertNotIsInstance(records, list)
+        self.assertEqual(list(decrypt_many(self.key, records, 1000, lazy=True)), self.messages)
+
+    def test_mixed_salts(self):
+        records = encrypt_many(self.key, self.messages[:2], 1000) + encrypt_many(self.key, self.messages[2:], 1000)
+        self.assertEqual(decrypt_many(self.key, records, 1000), self.messages)
+
+    def test_integrity(self):
+        records = encrypt_many(self.key, self.messages, 1000)
+        records[3] = records[3][:-1] + bytes([records[3][-1] ^ 1])
+        with self.assertRaises(AssertionError):
+            decrypt_many(self.key, records, 1000)
+
+class TestStream(unittest.TestCase):
+    """
+    Tests the chunked streaming functions `encrypt_stream` and
+    `decrypt_stream`.
+    """
+    def setUp(self):
+        self.key = b'master key'
+        self.chunk_size = 32
+
+    def encrypt(self, message):
+        destination = io.BytesIO()
+        encrypt_stream(self.key, io.BytesIO(message), destination, 1000, self.chunk_size)
+        return destination.getvalue()
+
+    def decrypt(self, ciphertext):
+        destination = io.BytesIO()
+        decrypt_stream(self.key, io.BytesIO(ciphertext), destination, 1000)
+        return destination.getvalue()
+
+    def test_success(self):
+        for message in (b'', b'secret message', b'M' * 32, b'M' * 100):
+            self.assertEqual(self.decrypt(self.encrypt(message)), message)
+
+    def test_no_expansion(self):
+        """ Only the header and one HMAC per chunk are added. """
+        ciphertext = self.encrypt(b'M' * 100)
+        self.assertEqual(len(ciphertext), 24 + 100 + 4 * 32)
+
+    def test_paths(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ('plain', 'encrypted', 'decrypted')]
+            with open(paths[0], 'wb') as f:
+                f.write(b'secret message' * 10)
+            encrypt_stream(self.key, paths[0], paths[1], 1000, self.chunk_size)
+            decrypt_stream(self.key, paths[1], paths[2], 1000)
+            with open(paths[2], 'rb') as f:
+                self.assertEqual(f.read(), b'secret message' * 10)
+
+    def test_integrity(self):
+        ciphertext = self.encrypt(b'M' * 100)
+        chunk = self.chunk_size + 32
+        first, second = ciphertext[24:24 + chunk], ciphertext[24 + chunk:24 + 2 * chunk]
+
+        with self.assertRaises(AssertionError):
+            self.decrypt(ciphertext[:-1] + bytes([ciphertext[-1] ^ 1]))
+
+        with self.assertRaises(AssertionError):
+            # Dropping the final chunk.
+            self.decrypt(ciphertext[:24 + 3 * chunk])
+
+        with self.assertRaises(AssertionError):
+            # Reordering chunks.
+            self.decrypt(ciphertext[:24] + second + first + ciphertext[24 + 2 * chunk:])
+
+class TestAsyncStream(unittest.TestCase):
+    """
+    Tests `AsyncAESStream` against the synchronous stream format.
+    """
+    class Writer:
+        def __init__(self):
+            self.data = io.BytesIO()
+            self.drains = 0
+
+        def write(self, data):
+            self.data.write(data)
+
+        async def drain(self):
+            self.drains += 1
+
+    class CountingExecutor(ThreadPoolExecutor):
+        def __init__(self):
+            super().__init__(4)
+            self.running = self.peak = 0
+            self.lock = threading.Lock()
+
+        def submit(self, function, *args):
+            def counted():
+                with self.lock:
+                    self.running += 1
+                    self.peak = max(self.peak, self.running)
+                try:
+                    time.sleep(0.001)
+                    return function(*args)
+                finally:
+                    with self.lock:
+                        self.running -= 1
+            return super().submit(counted)
+
+    def run_stream(self, data, method, **kwargs):
+        async def main():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            writer = TestAsyncStream.Writer()
+            stream = aes.AsyncAESStream(reader, writer, 'key', workload=10, **kwargs)
+            await getattr(stream, method)()
+            return writer
+        return asyncio.run(main())
+
+    def test_round_trip(self):
+        message = os.urandom(16 * 100 + 5)
+        with TestAsyncStream.CountingExecutor() as executor:
+            writer = self.run_stream(message, 'encrypt', chunk_size=64, executor=executor, max_in_flight=3)
+        self.assertLessEqual(executor.peak, 3)
+        self.assertEqual(writer.drains, len(message) // 64 + 1)
+
+        ciphertext = writer.data.getvalue()
+        output = io.BytesIO()
+        decrypt_stream('key', io.BytesIO(ciphertext), output, workload=10)
+        self.assertEqual(output.getvalue(), message)
+        self.assertEqual(self.run_stream(ciphertext, 'decrypt').data.getvalue(), message)
+
+    def test_tampered(self):
+        output = io.BytesIO()
+        encrypt_stream('key', io.BytesIO(b'M' * 100), output, workload=10, chunk_size=32)
+        ciphertext = bytearray(output.getvalue())
+        ciphertext[-40] ^= 1
+        with self.assertRaises(AssertionError):
+            self.run_stream(bytes(ciphertext), 'decrypt')
+
+
+class TestFiles(unittest.TestCase):
+    """
+    Tests the memory-mapped `encrypt_file` and `decrypt_file`.
+    """
+    def setUp(self):
+        self.key = b'master key'
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = lambda name: os.path.join(self.directory.name, name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, data):
+        with open(self.path(name), 'wb') as f:
+            f.write(data)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def test_success(self):
+        for message in (b'', b'secret message', b'M' * 64, bytes(range(256)) * 3):
+            self.write('plain', message)
+            self.assertEqual(encrypt_file(self.key, self.path('plain'), self.path('encrypted'), 1000, 64), len(message))
+            self.assertEqual(decrypt_file(self.key, self.path('encrypted'), self.path('decrypted'), 1000), len(message))
+            self.assertEqual(self.read('decrypted'), message)
+
+    def test_stream_compatible(self):
+        message = bytes(range(256)) * 3
+        self.write('plain', message)
+        encrypt_file(self.key, self.path('plain'), self.path('encrypted'), 1000, 64)
+        decrypted = io.BytesIO()
+        decrypt_stream(self.key, self.path('encrypted'), decrypted, 1000)
+        self.assertEqual(decrypted.getvalue(), message)
+
+        encrypt_stream(self.key, self.path('plain'), self.path('streamed'), 1000, 64)
+        decrypt_file(self.key, self.path('streamed'), self.path('decrypted'), 1000)
+        self.assertEqual(self.read('decrypted'), message)
+
+    def test_integrity(self):
+        self.write('plain', b'secret message' * 20)
+        encrypt_file(self.key, self.path('plain'), self.path('encrypted'), 1000, 64)
+        ciphertext = bytearray(self.read('encrypted'))
+        ciphertext[100] ^= 1
+        self.write('encrypted', ciphertext)
+        with self.assertRaises(AssertionError):
+            decrypt_file(self.key, self.path('encrypted'), self.path('decrypted'), 1000)
+        self.assertFalse(os.path.exists(self.path('decrypted')))
+
 class TestDetailedAES(unittest.TestCase):
     """
     Tests détaillés de l'AES avec affichage des étapes intermédiaires.
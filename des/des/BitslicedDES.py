@@ -0,0 +1,98 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class BitslicedDES:
+    """Bitsliced DES over NumPy arrays, for large batches of blocks.
+
+    The batch is transposed into 64 bit planes: plane i holds bit i (from
+    the most significant) of every block, 64 blocks per uint64 lane. The
+    permutations then only reorder planes, the key XOR inverts planes and
+    each S-box is a network of AND/OR/XOR gates generated from its table,
+    so every block of the batch advances through a round together. All
+    tables come from the rounds of the given DES object."""
+    def __init__(self, des):
+        if np is None:
+            raise ImportError("The bitsliced DES engine requires NumPy.")
+        mixer = des.rounds[0].mixer
+        self.initial = des.P_i.gather_indices()
+        self.final = des.P_f.gather_indices()
+        self.inverse_initial = des.P_i.invert().gather_indices()
+        self.inverse_final = des.P_f.invert().gather_indices()
+        self.expansion = mixer.initial_permutation.gather_indices()
+        self.round_final = mixer.final_permutation.gather_indices()
+        width = mixer.initial_permutation.out_degree
+        self.key_masks = [
+            np.array([-(key >> (width - 1 - i) & 1) for i in range(width)], dtype=np.int64).view(np.uint64)
+            for key in des.subkeys
+        ]
+        # The two least significant input bits select one of 16 Boolean
+        # functions of two variables; codes[box, k, output bit] is the truth
+        # table, over those two bits, of the output bit for inputs 4k..4k+3.
+        tables = [box.lookup_table() for box in mixer.substitutions]
+        self.codes = np.array([[[sum((table[4 * k + j] >> (3 - bit) & 1) << j for j in range(4))
+                                 for bit in range(4)] for k in range(16)] for table in tables])
+        self.boxes = np.arange(len(tables))[:, None, None]
+
+    def substitute(self, x):
+        """Evaluates the eight S-boxes on an (8, 6, lanes) array of input
+        planes, returning the (32, lanes) output planes.
+
+        The two least significant input bits are handled by building all 16
+        functions of them from their minterms and picking one per candidate.
+        Each remaining input bit then selects between pairs of candidates."""
+        b4, b5 = x[:, 4], x[:, 5]
+        n4, n5 = ~b4, ~b5
+        minterms = (n4 & n5, n4 & b5, b4 & n5, b4 & b5)
+        functions = np.empty((x.shape[0], 16, x.shape[2]), dtype=np.uint64)
+        functions[:, 0] = 0
+        for code in range(1, 16):
+            low = code & -code
+            functions[:, code] = functions[:, code ^ low] | minterms[low.bit_length() - 1]
+
+        t = functions[self.boxes, self.codes]
+        for bit in range(3, -1, -1):
+            a, b = t[:, 0::2], t[:, 1::2]
+            t = a ^ (x[:, bit, None, None, :] & (a ^ b))
+        return t.reshape(32, -1)
+
+    def crypt_planes(self, planes, initial, final, key_masks):
+        planes = planes[initial]
+        l, r = planes[:32], planes[32:]
+        last = len(key_masks) - 1
+        for i, mask in enumerate(key_masks):
+            e = r[self.expansion] ^ mask[:, None]
+            l = l ^ self.substitute(e.reshape(8, 6, -1))[self.round_final]
+            if i != last:
+                l, r = r, l
+        return np.concatenate((l, r))[final]
+
+    def crypt(self, blocks, decrypting=False, batch_size=1 << 14):
+        """Encrypts or decrypts a 1-dimensional array of 64-bit blocks,
+        batch_size blocks at a time so the planes stay in cache."""
+        blocks = np.ascontiguousarray(blocks, dtype=np.uint64)
+        if blocks.ndim != 1:
+            raise ValueError("Blocks must be a 1-dimensional array of 64-bit integers.")
+        if len(blocks) <= batch_size:
+            return self.crypt_batch(blocks, decrypting)
+        return np.concatenate([self.crypt_batch(blocks[i: i + batch_size], decrypting)
+                               for i in range(0, len(blocks), batch_size)])
+
+    def crypt_batch(self, blocks, decrypting):
+        n = len(blocks)
+        # (n, 64) bits, most significant first, then packed along the batch.
+        bits = np.unpackbits(blocks.astype('>u8').view(np.uint8).reshape(n, 8), axis=1)
+        lanes = -(-n // 64)
+        planes = np.zeros((64, lanes * 8), dtype=np.uint8)
+        planes[:, :-(-n // 8)] = np.packbits(bits.T, axis=1)
+        planes = planes.view(np.uint64)
+
+        if decrypting:
+            planes = self.crypt_planes(planes, self.inverse_final, self.inverse_initial, self.key_masks[::-1])
+        else:
+            planes = self.crypt_planes(planes, self.initial, self.final, self.key_masks)
+
+        bits = np.unpackbits(np.ascontiguousarray(planes).view(np.uint8), axis=1)[:, :n]
+        return np.ascontiguousarray(np.packbits(bits.T, axis=1)).view('>u8').reshape(n).astype(np.uint64)
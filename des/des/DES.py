@@ -1,3 +1,5 @@
+import struct
+
 from PBox import PBox
 from Mixer import Mixer
 from Round import Round
@@ -5,7 +7,7 @@ from utils import *
 
 
 class DES:
-    def __init__(self, key: int):
+    def __init__(self, key: int, trace=None):
         self.key = int_to_bin(key, block_size=64)
         self.PC_1 = PBox.des_key_initial_permutation()
         self.PC_2 = PBox.des_shifted_key_permutation()
@@ -13,26 +15,172 @@ class DES:
         self.P_f = PBox.des_final_permutation()
         self.single_shift = {1, 2, 9, 16}
         self.rounds = self.generate_rounds()
+        self.compile()
+        self.set_trace(trace)
+
+    def set_trace(self, trace):
+        """Sends the full per-round trace to a TraceSink (see TraceSink.py),
+        or disables it with None. While a sink is set, encrypt_number and
+        decrypt_number run on the traced binary path."""
+        self.trace = trace
+        for round in self.rounds:
+            round.set_trace(trace)
+
+    def compile(self):
+        """Builds the integer-native core used by encrypt_number and
+        decrypt_number from the PBox and SBox objects of the rounds: byte-
+        indexed tables for every permutation, the combined SP tables of the
+        mixer and the round keys as ints."""
+        mixer = self.rounds[0].mixer
+        self.subkeys = [round.mixer.key for round in self.rounds]
+        self.initial_tables = self.P_i.lookup_tables()
+        self.final_tables = self.P_f.lookup_tables()
+        self.inverse_initial_tables = self.P_i.invert().lookup_tables()
+        self.inverse_final_tables = self.P_f.invert().lookup_tables()
+        self.expansion_tables = mixer.initial_permutation.lookup_tables()
+        self.sp_tables = mixer.sp_tables()
+
+    def crypt_number(self, number: int, initial: list, final: list, subkeys: list) -> int:
+        """Runs the rounds on a 64-bit int: every round but the last mixes
+        then swaps the halves, exactly like Round.with_swapper."""
+        t0, t1, t2, t3, t4, t5, t6, t7 = initial
+        x = (t0[number & 0xFF] | t1[number >> 8 & 0xFF] | t2[number >> 16 & 0xFF] | t3[number >> 24 & 0xFF] |
+             t4[number >> 32 & 0xFF] | t5[number >> 40 & 0xFF] | t6[number >> 48 & 0xFF] | t7[number >> 56])
+        l, r = x >> 32, x & 0xFFFFFFFF
+        e0, e1, e2, e3 = self.expansion_tables
+        sp1, sp2, sp3, sp4, sp5, sp6, sp7, sp8 = self.sp_tables
+        last = len(subkeys) - 1
+        for i, key in enumerate(subkeys):
+            e = (e0[r & 0xFF] | e1[r >> 8 & 0xFF] | e2[r >> 16 & 0xFF] | e3[r >> 24]) ^ key
+            l ^= (sp1[e >> 42] | sp2[e >> 36 & 0x3F] | sp3[e >> 30 & 0x3F] | sp4[e >> 24 & 0x3F] |
+                  sp5[e >> 18 & 0x3F] | sp6[e >> 12 & 0x3F] | sp7[e >> 6 & 0x3F] | sp8[e & 0x3F])
+            if i != last:
+                l, r = r, l
+        x = l << 32 | r
+        t0, t1, t2, t3, t4, t5, t6, t7 = final
+        return (t0[x & 0xFF] | t1[x >> 8 & 0xFF] | t2[x >> 16 & 0xFF] | t3[x >> 24 & 0xFF] |
+                t4[x >> 32 & 0xFF] | t5[x >> 40 & 0xFF] | t6[x >> 48 & 0xFF] | t7[x >> 56])
 
     def encrypt(self, binary: str) -> str:
         binary = self.P_i.permutate(binary)
+        if self.trace is not None:
+            self.trace.emit("After initial permutation", binary)
         for round in self.rounds:
             binary = round.encrypt(binary)
         return self.P_f.permutate(binary)
 
     def decrypt(self, binary: str) -> str:
         binary = self.P_f.invert().permutate(binary)
+        if self.trace is not None:
+            self.trace.emit("After initial permutation", binary)
         for round in self.rounds[::-1]:
             binary = round.decrypt(binary)
         return self.P_i.invert().permutate(binary)
 
     def encrypt_number(self, number: int) -> int:
-        binary = int_to_bin(number, block_size=64)
-        return int(self.encrypt(binary), base=2)
+        if self.trace is not None:
+            return int(self.encrypt(int_to_bin(number, block_size=64)), base=2)
+        return self.crypt_number(number, self.initial_tables, self.final_tables, self.subkeys)
 
     def decrypt_number(self, number: int) -> int:
-        binary = int_to_bin(number, block_size=64)
-        return int(self.decrypt(binary), base=2)
+        if self.trace is not None:
+            return int(self.decrypt(int_to_bin(number, block_size=64)), base=2)
+        return self.crypt_number(number, self.inverse_final_tables, self.inverse_initial_tables, self.subkeys[::-1])
+
+    def encrypt_bytes(self, data: bytes, mode='ecb', iv: bytes = None) -> bytes:
+        """Encrypts bytes packed 8 per block. ECB and CBC add PKCS#7 padding;
+        CTR needs no padding, so the ciphertext is as long as the data. CBC
+        and CTR take an 8-byte iv, used as the initial counter in CTR."""
+        mode = self.check_mode(mode, iv)
+        if mode == 'ctr':
+            return self.ctr_bytes(data, iv)
+        blocks = unpack_blocks(pkcs7_pad(data))
+        encrypt = self.encrypt_number
+        if mode == 'ecb':
+            result = [encrypt(block) for block in blocks]
+        else:
+            previous = int.from_bytes(iv, 'big')
+            result = []
+            for block in blocks:
+                previous = encrypt(block ^ previous)
+                result.append(previous)
+        return pack_blocks(result)
+
+    def decrypt_bytes(self, data: bytes, mode='ecb', iv: bytes = None) -> bytes:
+        """Decrypts bytes produced by encrypt_bytes with the same mode and iv."""
+        mode = self.check_mode(mode, iv)
+        if mode == 'ctr':
+            return self.ctr_bytes(data, iv)
+        if len(data) % 8:
+            raise ValueError("Ciphertext length must be a multiple of 8 bytes.")
+        blocks = unpack_blocks(data)
+        decrypt = self.decrypt_number
+        if mode == 'ecb':
+            result = [decrypt(block) for block in blocks]
+        else:
+            previous = int.from_bytes(iv, 'big')
+            result = []
+            for block in blocks:
+                result.append(decrypt(block) ^ previous)
+                previous = block
+        return pkcs7_unpad(pack_blocks(result))
+
+    def ctr_bytes(self, data: bytes, iv: bytes, first_block=0) -> bytes:
+        """XORs data with the CTR keystream starting at block first_block."""
+        counter = int.from_bytes(iv, 'big') + first_block
+        encrypt = self.encrypt_number
+        n_blocks = (len(data) + 7) // 8
+        keystream = pack_blocks([encrypt((counter + i) & 0xFFFFFFFFFFFFFFFF) for i in range(n_blocks)])
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(keystream[:len(data)], 'big')).to_bytes(len(data), 'big')
+
+    def encrypt_stream(self, source, destination, iv: bytes, chunk_size=64 * 1024) -> int:
+        """Encrypts a binary file object into another in CTR mode, chunk by
+        chunk, so memory stays bounded and the output is as long as the
+        input. Returns the number of bytes written."""
+        self.check_mode('ctr', iv)
+        if chunk_size <= 0 or chunk_size % 8:
+            raise ValueError("Chunk size must be a positive multiple of 8 bytes.")
+        total = 0
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return total
+            # Short reads are fine as long as chunks stay block aligned.
+            while len(chunk) % 8:
+                more = source.read(8 - len(chunk) % 8)
+                if not more:
+                    break
+                chunk += more
+            destination.write(self.ctr_bytes(chunk, iv, total // 8))
+            total += len(chunk)
+
+    def decrypt_stream(self, source, destination, iv: bytes, chunk_size=64 * 1024) -> int:
+        """Decrypts a stream written by encrypt_stream with the same iv."""
+        return self.encrypt_stream(source, destination, iv, chunk_size)
+
+    def encrypt_blocks(self, blocks):
+        """Encrypts a NumPy array of 64-bit integer blocks with the bitsliced
+        engine (see BitslicedDES.py). Matches encrypt_number bit for bit."""
+        return self.bitsliced().crypt(blocks)
+
+    def decrypt_blocks(self, blocks):
+        """Decrypts a NumPy array of 64-bit integer blocks, see encrypt_blocks."""
+        return self.bitsliced().crypt(blocks, decrypting=True)
+
+    def bitsliced(self):
+        if getattr(self, 'bitsliced_engine', None) is None:
+            from BitslicedDES import BitslicedDES
+            self.bitsliced_engine = BitslicedDES(self)
+        return self.bitsliced_engine
+
+    @staticmethod
+    def check_mode(mode: str, iv: bytes) -> str:
+        mode = mode.lower()
+        if mode not in ('ecb', 'cbc', 'ctr'):
+            raise ValueError(f"Unsupported mode: {mode}")
+        if mode != 'ecb' and (iv is None or len(iv) != 8):
+            raise ValueError(f"{mode.upper()} mode needs an 8-byte iv.")
+        return mode
 
     def encrypt_message(self, plaintext: str) -> list:
         result = [0] * len(plaintext)
@@ -57,4 +205,12 @@ class DES:
             mixer = Mixer.des_mixer(key)
             cipher = Round.with_swapper(mixer) if i != 16 else Round.without_swapper(mixer)
             rounds.append(cipher)
-        return rounds
\ No newline at end of file
+        return rounds
+
+
+def unpack_blocks(data: bytes) -> tuple:
+    return struct.unpack(f'>{len(data) // 8}Q', data)
+
+
+def pack_blocks(blocks: list) -> bytes:
+    return struct.pack(f'>{len(blocks)}Q', *blocks)
@@ -6,7 +6,7 @@ from SBox import SBox
 class Mixer:
     def __init__(self, key: int, func=lambda a, b: a ^ b, block_size=64,
                  initial_permutation=None, final_permutation=None,
-                 substitutions: list = None, substitution_block_size=6):
+                 substitutions: list = None, substitution_block_size=6, trace=None):
         self.func = func
         self.block_size = block_size
         self.initial_permutation = PBox.identity(block_size // 2) if initial_permutation is None else initial_permutation
@@ -14,51 +14,69 @@ class Mixer:
         self.substitutions = SBox.des_single_round_substitutions() if substitutions is None else substitutions
         self.substitution_block_size = substitution_block_size
         self.key = key
+        self.trace = trace
 
     def encrypt(self, binary: str) -> str:
-        print(f"\n=== Feistel Round ===")
-        print(f"Input binary: {binary}")
-        
         # Split into left and right halves
         l, r = binary[0: self.block_size // 2], binary[self.block_size // 2:]
-        print(f"Left half: {l}")
-        print(f"Right half: {r}")
-        
+
         # Expansion PBox (32 bits -> 48 bits)
         r1: str = self.initial_permutation.permutate(r)
-        print(f"After expansion: {r1}")
-        print(f"Expansion length: {len(r1)} bits")
-        
+
         # XOR with key
         r2: str = int_to_bin(self.func(int(r1, base=2), self.key), block_size=self.initial_permutation.out_degree)
-        print(f"After XOR with key: {r2}")
-        
+
         # S-box substitution
-        r3: str = ''
-        for i in range(len(self.substitutions)):
-            block: str = r2[i * self.substitution_block_size: (i + 1) * self.substitution_block_size]
-            substituted = self.substitutions[i](block)
-            print(f"S-box {i+1} input: {block} -> output: {substituted}")
-            r3 += substituted
-        print(f"After S-boxes: {r3}")
-        print(f"S-box output length: {len(r3)} bits")
-        
+        size = self.substitution_block_size
+        inputs = [r2[i * size: (i + 1) * size] for i in range(len(self.substitutions))]
+        outputs = [box(block) for box, block in zip(self.substitutions, inputs)]
+        r3: str = ''.join(outputs)
+
         # Final permutation
-        r3: str = self.final_permutation.permutate(r3)
-        print(f"After final permutation: {r3}")
-        
+        r4: str = self.final_permutation.permutate(r3)
+
         # XOR with left half
-        l_new = int_to_bin(int(l, base=2) ^ int(r3, base=2), block_size=self.block_size // 2)
-        print(f"New left half: {l_new}")
-        
-        # Combine and return
+        l_new = int_to_bin(int(l, base=2) ^ int(r4, base=2), block_size=self.block_size // 2)
         result = l_new + r
-        print(f"Final result: {result}")
+
+        if self.trace is not None:
+            self.emit_trace(binary, l, r, r1, r2, inputs, outputs, r3, r4, l_new, result)
         return result
 
+    def emit_trace(self, binary, l, r, r1, r2, inputs, outputs, r3, r4, l_new, result):
+        trace = self.trace
+        trace.emit("Feistel Round")
+        trace.emit("Input binary", binary)
+        trace.emit("Left half", l)
+        trace.emit("Right half", r)
+        trace.emit("After expansion", r1)
+        trace.emit("After XOR with key", r2)
+        for i, (block, substituted) in enumerate(zip(inputs, outputs)):
+            trace.emit(f"S-box {i + 1} input", block)
+            trace.emit(f"S-box {i + 1} output", substituted)
+        trace.emit("After S-boxes", r3)
+        trace.emit("After final permutation", r4)
+        trace.emit("New left half", l_new)
+        trace.emit("Final result", result)
+
     def decrypt(self, binary: str) -> str:
         return self.encrypt(binary)
 
+    def sp_tables(self) -> list:
+        """Combined substitution-permutation tables: for S-box i, entry v is
+        the output of the box for input v, placed at its position in the
+        round and passed through the final permutation. Since that
+        permutation is linear over XOR, the round function is the OR of one
+        lookup per S-box."""
+        half = self.block_size // 2
+        out_size = half // len(self.substitutions)
+        tables = []
+        for i, box in enumerate(self.substitutions):
+            shift = half - (i + 1) * out_size
+            tables.append(tuple(self.final_permutation.permutate_number(value << shift)
+                                for value in box.lookup_table(self.substitution_block_size)))
+        return tables
+
     @staticmethod
     def des_mixer(key: int):
         return Mixer(
@@ -1,9 +1,11 @@
 from utils import *
 
 class PBox:
-    def __init__(self, key: dict):
+    def __init__(self, key: dict, width: int = None):
         self.key = key
         self.in_degree = len(key)
+        # Bits of the input; wider than in_degree when some bits are dropped.
+        self.width = self.in_degree if width is None else width
         self.out_degree = sum(len(value) if isinstance(value, list) else 1 for value in key.values())
 
     def __repr__(self) -> str:
@@ -19,6 +21,45 @@ class PBox:
                     result[i - 1] = value
         return ''.join(map(str, result))
 
+    def lookup_tables(self) -> list:
+        """Compiles the permutation into byte-indexed tables over integers.
+
+        Table k maps the value of input byte k (counting from the least
+        significant bit) to the output bits it sets, so permutating a number
+        is one lookup per input byte, ORed together."""
+        if getattr(self, '_tables', None) is None:
+            width = self.width
+            tables = [[0] * 256 for _ in range((width + 7) // 8)]
+            for index, indices in self.key.items():
+                indices = indices if isinstance(indices, list) else [indices]
+                # Position 1 is the most significant bit, as in the strings.
+                bit = width - index
+                mask = 0
+                for i in indices:
+                    mask |= 1 << (self.out_degree - i)
+                table = tables[bit // 8]
+                for value in range(256):
+                    if value >> (bit % 8) & 1:
+                        table[value] |= mask
+            self._tables = [tuple(table) for table in tables]
+        return self._tables
+
+    def gather_indices(self) -> list:
+        """For every output position, the 0-based input position it copies."""
+        result = [0] * self.out_degree
+        for index, indices in self.key.items():
+            for i in (indices if isinstance(indices, list) else [indices]):
+                result[i - 1] = index - 1
+        return result
+
+    def permutate_number(self, number: int) -> int:
+        """Same as permutate, on the bits of a `width`-bit integer."""
+        result = 0
+        for table in self.lookup_tables():
+            result |= table[number & 0xFF]
+            number >>= 8
+        return result
+
     def is_invertible(self) -> bool:
         return self.in_degree == self.out_degree
 
@@ -27,20 +68,20 @@ class PBox:
             result = {}
             for index, mapping in self.key.items():
                 result[mapping[0]] = index
-            return PBox(result)
+            return PBox(result, self.out_degree)
 
     @staticmethod
     def identity(block_size=64):
-        return PBox({index: index for index in range(1, block_size + 1)})
+        return PBox({index: index for index in range(1, block_size + 1)}, block_size)
 
     @staticmethod
-    def from_list(permutation: list):
+    def from_list(permutation: list, width: int):
         mapping = {}
         for index, value in enumerate(permutation):
             indices = mapping.get(value, [])
             indices.append(index + 1)
             mapping[value] = indices
-        return PBox(mapping)
+        return PBox(mapping, width)
 
     @staticmethod
     def des_initial_permutation():
@@ -52,7 +93,8 @@ class PBox:
              57, 49, 41, 33, 25, 17, 9, 1,
              59, 51, 43, 35, 27, 19, 11, 3,
              61, 53, 45, 37, 29, 21, 13, 5,
-             63, 55, 47, 39, 31, 23, 15, 7]
+             63, 55, 47, 39, 31, 23, 15, 7],
+            64
         )
 
     @staticmethod
@@ -65,7 +107,8 @@ class PBox:
              36, 4, 44, 12, 52, 20, 60, 28,
              35, 3, 43, 11, 51, 19, 59, 27,
              34, 2, 42, 10, 50, 18, 58, 26,
-             33, 1, 41, 9, 49, 17, 57, 25]
+             33, 1, 41, 9, 49, 17, 57, 25],
+            64
         )
 
     @staticmethod
@@ -79,7 +122,8 @@ class PBox:
              16, 17, 18, 19, 20, 21,
              20, 21, 22, 23, 24, 25,
              24, 25, 26, 27, 28, 29,
-             28, 29, 30, 31, 32, 1]
+             28, 29, 30, 31, 32, 1],
+            32
         )
 
     @staticmethod
@@ -89,7 +133,8 @@ class PBox:
             [16, 7, 20, 21, 29, 12, 28, 17,
              1, 15, 23, 26, 5, 18, 31, 10,
              2, 8, 24, 14, 32, 27, 3, 9,
-             19, 13, 30, 6, 22, 11, 4, 25]
+             19, 13, 30, 6, 22, 11, 4, 25],
+            32
         )
 
     @staticmethod
@@ -102,7 +147,8 @@ class PBox:
              63, 55, 47, 39, 31, 23, 15,
              7, 62, 54, 46, 38, 30, 22,
              14, 6, 61, 53, 45, 37, 29,
-             21, 13, 5, 28, 20, 12, 4]
+             21, 13, 5, 28, 20, 12, 4],
+            64
         )
 
     @staticmethod
@@ -114,5 +160,6 @@ class PBox:
              26, 8, 16, 7, 27, 20, 13, 2,
              41, 52, 31, 37, 47, 55, 30, 40,
              51, 45, 33, 48, 44, 49, 39, 56,
-             34, 53, 46, 42, 50, 36, 29, 32]
-        )
\ No newline at end of file
+             34, 53, 46, 42, 50, 36, 29, 32],
+            56
+        )
@@ -8,6 +8,7 @@ class Round:
     def __init__(self, mixer):
         self.mixer = mixer
         self.swapper = NoneSwapper()
+        self.trace = None
 
     @staticmethod
     def with_swapper(mixer: Mixer):
@@ -19,10 +20,21 @@ class Round:
     def without_swapper(mixer: Mixer):
         return Round(mixer)
 
+    def set_trace(self, trace):
+        """Sends the trace of this round and its mixer to a TraceSink, or
+        disables it with None."""
+        self.trace = trace
+        self.mixer.trace = trace
+
     def encrypt(self, binary: str) -> str:
         binary = self.mixer.encrypt(binary)
-        return self.swapper.encrypt(binary)
+        binary = self.swapper.encrypt(binary)
+        if self.trace is not None:
+            self.trace.emit("After swap", binary)
+        return binary
 
     def decrypt(self, binary: str) -> str:
         binary = self.swapper.decrypt(binary)
+        if self.trace is not None:
+            self.trace.emit("After swap", binary)
         return self.mixer.decrypt(binary)
\ No newline at end of file
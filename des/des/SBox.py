@@ -15,6 +15,10 @@ class SBox:
         else:
             return binary
 
+    def lookup_table(self, in_size=6) -> tuple:
+        """Returns the output of the box for every in_size-bit input, as ints."""
+        return tuple(int(self(int_to_bin(value, block_size=in_size)), base=2) for value in range(1 << in_size))
+
     @staticmethod
     def des_single_round_substitutions():
         return [SBox.forDESSubstitution(block) for block in range(1, 9)]
@@ -0,0 +1,34 @@
+import sys
+from abc import ABC, abstractmethod
+
+
+class TraceSink(ABC):
+    """Receives the intermediate values of DES, Round and Mixer as
+    (label, value) events. A value of None marks the start of a section."""
+    @abstractmethod
+    def emit(self, label: str, value=None) -> None:
+        pass
+
+
+class ListSink(TraceSink):
+    """Collects every event in self.events."""
+    def __init__(self):
+        self.events = []
+
+    def emit(self, label: str, value=None) -> None:
+        self.events.append((label, value))
+
+    def values(self, label: str) -> list:
+        return [value for event, value in self.events if event == label]
+
+
+class FileSink(TraceSink):
+    """Writes every event as a line of text, to stdout by default."""
+    def __init__(self, file=None):
+        self.file = sys.stdout if file is None else file
+
+    def emit(self, label: str, value=None) -> None:
+        if value is None:
+            self.file.write(f"\n=== {label} ===\n")
+        else:
+            self.file.write(f"{label}: {value}\n")
@@ -5,4 +5,6 @@ from des.Mixer import Mixer
 from des.DES import DES
 from des.PBox import PBox
 from des.SBox import SBox
+from des.BitslicedDES import BitslicedDES
+from des.TraceSink import TraceSink, ListSink, FileSink
 from des.utils import *
\ No newline at end of file
@@ -1,4 +1,13 @@
+import contextlib
+import io
+import random
+
+import pytest
+
 from DES import DES
+from PBox import PBox
+from TraceSink import TraceSink, ListSink, FileSink
+from utils import int_to_bin, pkcs7_pad
 
 def test_des():
     # Clé de test (64 bits)
@@ -42,5 +51,95 @@ def test_des():
     else:
         print("❌ Test échoué: Le message déchiffré ne correspond pas au message original!")
 
+def test_permutate_number():
+    for box in (PBox.des_initial_permutation(), PBox.des_final_permutation(),
+                PBox.des_final_permutation().invert(), PBox.des_single_round_expansion(),
+                PBox.des_single_round_final(), PBox.des_key_initial_permutation(),
+                PBox.des_shifted_key_permutation()):
+        for _ in range(50):
+            number = random.getrandbits(box.width)
+            assert box.permutate_number(number) == int(box.permutate(int_to_bin(number, block_size=box.width)), base=2)
+    assert PBox.des_key_initial_permutation().permutate_number(0x133457799BBCDFF1) == 0xF0CCAAF556678F
+
+def test_sp_tables():
+    des = DES(0x133457799BBCDFF1)
+    mixer = des.rounds[0].mixer
+    for i, (box, table) in enumerate(zip(mixer.substitutions, des.sp_tables)):
+        assert len(table) == 64
+        for value in range(64):
+            expected = mixer.final_permutation.permutate(
+                '0000' * i + box(int_to_bin(value, block_size=6)) + '0000' * (7 - i))
+            assert table[value] == int(expected, base=2)
+
+def test_number_matches_binary():
+    des = DES(0x133457799BBCDFF1)
+    for number in (0, 0x0123456789ABCDEF, 0xFFFFFFFFFFFFFFFF, random.getrandbits(64)):
+        binary = int_to_bin(number, block_size=64)
+        encrypted = int(des.encrypt(binary), base=2)
+        decrypted = int(des.decrypt(binary), base=2)
+        assert des.encrypt_number(number) == encrypted
+        assert des.decrypt_number(number) == decrypted
+        assert des.decrypt_number(encrypted) == number
+    assert des.encrypt_number(0x0123456789ABCDEF) == 0x6C58513A581744D0
+
+def test_trace():
+    des = DES(0x133457799BBCDFF1)
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        encrypted = des.encrypt_number(0x0123456789ABCDEF)
+    assert output.getvalue() == ''
+
+    sink = ListSink()
+    des.set_trace(sink)
+    assert des.encrypt_number(0x0123456789ABCDEF) == encrypted
+    assert len(sink.values("Feistel Round")) == 16
+    assert len(sink.values("S-box 8 input")) == 16
+    assert all(len(value) == 4 for value in sink.values("S-box 1 output"))
+    assert sink.values("Final result")[0][32:] == sink.values("Right half")[0]
+
+    output = io.StringIO()
+    des.set_trace(FileSink(output))
+    assert des.decrypt_number(encrypted) == 0x0123456789ABCDEF
+    assert output.getvalue().count("=== Feistel Round ===") == 16
+    assert "After expansion: " in output.getvalue()
+
+    with pytest.raises(TypeError):
+        TraceSink()
+
+def test_bytes_modes():
+    des = DES(0x133457799BBCDFF1)
+    iv = bytes(range(8))
+    for data in (b'', b'short', b'exactly8', bytes(range(100))):
+        ecb = des.encrypt_bytes(data)
+        assert len(ecb) == len(data) // 8 * 8 + 8
+        assert ecb[:8] == des.encrypt_number(int.from_bytes(pkcs7_pad(data)[:8], 'big')).to_bytes(8, 'big')
+        assert des.decrypt_bytes(ecb) == data
+        assert des.decrypt_bytes(des.encrypt_bytes(data, 'cbc', iv), 'cbc', iv) == data
+        ctr = des.encrypt_bytes(data, 'ctr', iv)
+        assert len(ctr) == len(data)
+        assert des.decrypt_bytes(ctr, 'ctr', iv) == data
+    assert des.encrypt_bytes(b'A' * 16, 'cbc', iv)[8:] != des.encrypt_bytes(b'A' * 16, 'cbc', iv)[:8]
+
+def test_stream():
+    des = DES(0x133457799BBCDFF1)
+    iv = b'\xff' * 8
+    data = bytes(random.getrandbits(8) for _ in range(1001))
+    encrypted = io.BytesIO()
+    assert des.encrypt_stream(io.BytesIO(data), encrypted, iv, chunk_size=64) == len(data)
+    assert encrypted.getvalue() == des.encrypt_bytes(data, 'ctr', iv)
+    decrypted = io.BytesIO()
+    des.decrypt_stream(io.BytesIO(encrypted.getvalue()), decrypted, iv, chunk_size=16)
+    assert decrypted.getvalue() == data
+
+def test_bitsliced_blocks():
+    np = pytest.importorskip('numpy')
+    des = DES(0x133457799BBCDFF1)
+    for n in (1, 64, 130):
+        blocks = np.array([random.getrandbits(64) for _ in range(n)], dtype=np.uint64)
+        encrypted = des.encrypt_blocks(blocks)
+        assert [int(block) for block in encrypted] == [des.encrypt_number(int(block)) for block in blocks]
+        assert (des.decrypt_blocks(encrypted) == blocks).all()
+    blocks = np.arange(1000, dtype=np.uint64)
+    assert (des.bitsliced().crypt(blocks, batch_size=128) == des.encrypt_blocks(blocks)).all()
+
 if __name__ == "__main__":
     test_des() 
\ No newline at end of file
@@ -17,4 +17,18 @@ def mod(a, b):
 
 def left_circ_shift(binary: str, shift: int) -> str:
     shift = shift % len(binary)
-    return binary[shift:] + binary[0: shift]
\ No newline at end of file
+    return binary[shift:] + binary[0: shift]
+
+
+def pkcs7_pad(data: bytes, block_size=8) -> bytes:
+    padding = block_size - len(data) % block_size
+    return data + bytes([padding] * padding)
+
+
+def pkcs7_unpad(data: bytes, block_size=8) -> bytes:
+    if not data or len(data) % block_size:
+        raise ValueError("Padded data must be a non-empty multiple of the block size.")
+    padding = data[-1]
+    if not 1 <= padding <= block_size or data[-padding:] != bytes([padding] * padding):
+        raise ValueError("Invalid PKCS#7 padding.")
+    return data[:-padding]